@@ -2,25 +2,39 @@
 # - 모든 멀티라인 문자열은 삼중 따옴표 또는 괄호 연결 + .format() 사용 (f-string 미사용)
 # - 텔레그램 슬래시 명령은 영문으로 등록(호환), 실제 사용은 한글 텍스트 또는 "-명령어" 권장
 
+from __future__ import annotations
+
+import time
+
+_MODULE_STARTED = time.perf_counter()
+
 import os
+import io
+import sys
 import logging
+import threading
 import random
 import asyncio
+import signal
+import csv
+import math
+import mmap
+import heapq
+import struct
+import hashlib
+import itertools
+from array import array
+from collections import deque
+from contextlib import contextmanager
 from dataclasses import dataclass, field
-from typing import Dict, List, Optional, Tuple, Set, Any
+from typing import Dict, List, Optional, Tuple, Set, Any, Deque, Callable, Awaitable, Iterator, Sequence, TYPE_CHECKING
 from datetime import datetime, timedelta, timezone
 
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import (
-    Application,
-    ApplicationBuilder,
-    CommandHandler,
-    ContextTypes,
-    CallbackQueryHandler,
-    MessageHandler,
-    filters,
-)
-from telegram.error import BadRequest, Forbidden
+# python-telegram-bot 은 import 비용이 커서 load_telegram() 에서 지연 로드 (타입 표기만 여기서)
+if TYPE_CHECKING:
+    from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+    from telegram.ext import Application, ApplicationHandlerStop, ContextTypes
+    from telegram.error import BadRequest, Forbidden, RetryAfter
 
 # =====================
 # 설정/환경변수
@@ -29,8 +43,23 @@ BOT_TOKEN = os.getenv("BOT_TOKEN")
 MONGODB_URI = os.getenv("MONGODB_URI")
 PRIMARY_ADMIN_ID = int(os.getenv("ADMIN_USER_ID", "0"))
 
+# MongoDB 연결 풀/타임아웃/쓰기 보장 수준
+MONGO_MAX_POOL = int(os.getenv("MONGO_MAX_POOL", "50"))
+MONGO_MIN_POOL = int(os.getenv("MONGO_MIN_POOL", "0"))
+MONGO_TIMEOUT_MS = int(os.getenv("MONGO_TIMEOUT_MS", "5000"))
+MONGO_WRITE_CONCERN = os.getenv("MONGO_WRITE_CONCERN", "1")  # 숫자 또는 "majority"
+# 시작 시 ping 재시도 횟수 (1, 2, 4 ... 초 간격, 최대 30초) — 모두 실패하면 기동 중단
+MONGO_CONNECT_RETRIES = int(os.getenv("MONGO_CONNECT_RETRIES", "6"))
+
+# DB 회로 차단기: 느린 호출 기준 / 연속 실패 임계값 / 차단 유지 시간 / 대기 쓰기 상한
+DB_SLOW_MS = int(os.getenv("DB_SLOW_MS", "500"))
+DB_BREAKER_THRESHOLD = int(os.getenv("DB_BREAKER_THRESHOLD", "5"))
+DB_BREAKER_COOLDOWN_SEC = int(os.getenv("DB_BREAKER_COOLDOWN_SEC", "10"))
+DB_WRITE_QUEUE_MAX = int(os.getenv("DB_WRITE_QUEUE_MAX", "10000"))
+
 BETTING_SECONDS = int(os.getenv("BETTING_SECONDS", "20"))
 EXCHANGE_SECONDS = int(os.getenv("EXCHANGE_SECONDS", "20"))
+EXCHANGE_CONCURRENT = os.getenv("EXCHANGE_CONCURRENT", "1") == "1"  # 교환을 전원 동시 선택으로 진행
 ANTE_DEFAULT = int(os.getenv("ANTE", "10"))
 STARTING_CHIPS = int(os.getenv("STARTING_CHIPS", "200"))
 MIN_PLAYERS = int(os.getenv("MIN_PLAYERS", "2"))
@@ -38,6 +67,11 @@ MAX_PLAYERS = int(os.getenv("MAX_PLAYERS", "6"))
 MIN_CHIPS_DEFAULT = int(os.getenv("MIN_CHIPS_DEFAULT", "1000"))
 JOIN_BONUS = int(os.getenv("JOIN_BONUS", "50"))
 CHECKIN_REWARD = int(os.getenv("CHECKIN_REWARD", "1000"))
+JOIN_BATCH_MS = int(os.getenv("JOIN_BATCH_MS", "300"))  # 참가 버튼 묶음 처리 대기(ms)
+
+# 통계 집계: 일별 버킷 보관 기간 / 월별 압축 주기
+STATS_DAILY_KEEP_DAYS = int(os.getenv("STATS_DAILY_KEEP_DAYS", "35"))
+STATS_COMPACT_INTERVAL_SEC = int(os.getenv("STATS_COMPACT_INTERVAL_SEC", "3600"))
 
 RAISE_CHOICES = [int(x) for x in os.getenv("RAISE_CHOICES", "10,20,50").split(",") if x.strip().isdigit()]
 
@@ -48,8 +82,56 @@ GIVEAWAY_MAX = int(os.getenv("GIVEAWAY_MAX", "100"))
 GIVEAWAY_USER_COOLDOWN_MIN = int(os.getenv("GIVEAWAY_USER_COOLDOWN_MIN", "30"))
 GIVEAWAY_CHAT_COOLDOWN_SEC = int(os.getenv("GIVEAWAY_CHAT_COOLDOWN_SEC", "90"))
 
+# 봇 좌석(AI 플레이어): 자동 채우기 여부 / 봇 칩(메모리 전용)
+BOT_FILL = os.getenv("BOT_FILL", "0") == "1"
+BOT_STACK = int(os.getenv("BOT_STACK", "5000"))
+
+# 토너먼트: 바이인 / 시작 스택 / 테이블 정원 / 레벨 시간 / 앤티 증가 / 상금 배분(%)
+TOUR_BUYIN_DEFAULT = int(os.getenv("TOUR_BUYIN", "500"))
+TOUR_STACK = int(os.getenv("TOUR_STACK", "1000"))
+TOUR_TABLE_SIZE = int(os.getenv("TOUR_TABLE_SIZE", str(MAX_PLAYERS)))
+TOUR_LEVEL_SECONDS = int(os.getenv("TOUR_LEVEL_SECONDS", "300"))
+TOUR_ANTE_START = int(os.getenv("TOUR_ANTE_START", "10"))
+TOUR_ANTE_GROWTH = float(os.getenv("TOUR_ANTE_GROWTH", "1.5"))
+TOUR_REG_SECONDS = int(os.getenv("TOUR_REG_SECONDS", "900"))  # 등록 마감: 시작하지 않으면 자동 취소·바이인 환불
+TOUR_PAYOUTS = [int(x) for x in os.getenv("TOUR_PAYOUTS", "50,30,20").split(",") if x.strip().isdigit()]
+
+# 입력 속도 제한(토큰 버킷) / 과부하 판정 기준(이벤트 루프 지연)
+RATE_USER_PER_SEC = float(os.getenv("RATE_USER_PER_SEC", "1"))
+RATE_USER_BURST = int(os.getenv("RATE_USER_BURST", "5"))
+RATE_CHAT_PER_SEC = float(os.getenv("RATE_CHAT_PER_SEC", "5"))
+RATE_CHAT_BURST = int(os.getenv("RATE_CHAT_BURST", "20"))
+LOOP_LAG_THRESHOLD_MS = int(os.getenv("LOOP_LAG_THRESHOLD_MS", "250"))
+
+# 사전 계산 테이블 캐시 디렉터리
+CACHE_DIR = os.getenv("CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache"))
+
+# 런타임 프로파일러: 최대 실행 시간 / 샘플 간격(ms) / 리포트 상위 N
+PROFILE_MAX_SECONDS = int(os.getenv("PROFILE_MAX_SECONDS", "120"))
+PROFILE_SAMPLE_MS = float(os.getenv("PROFILE_SAMPLE_MS", "5"))
+PROFILE_TOP_N = int(os.getenv("PROFILE_TOP_N", "15"))
+
+# 종료 드레인: 진행 중인 판 마무리 대기 한도(초) / 재시작 시 밀린 업데이트 폐기 여부
+DRAIN_SECONDS = int(os.getenv("DRAIN_SECONDS", "120"))
+DROP_PENDING_UPDATES = os.getenv("DROP_PENDING_UPDATES", "0") == "1"
+
+# 관리자 일괄 칩 작업: 배치 크기 / 배치 사이 쉬는 시간(ms) / 활성 유저 기준(일) / CSV 최대 행 수
+BULK_BATCH = int(os.getenv("BULK_BATCH", "500"))
+BULK_PAUSE_MS = int(os.getenv("BULK_PAUSE_MS", "200"))
+BULK_ACTIVE_DAYS = int(os.getenv("BULK_ACTIVE_DAYS", "30"))
+BULK_CSV_MAX = int(os.getenv("BULK_CSV_MAX", "100000"))
+
+# 칩 경제 모니터링: 분 단위 버킷 보관/이상 탐지 창/임계값/DB 적재 주기
+ECON_RETENTION_MIN = int(os.getenv("ECON_RETENTION_MIN", "1440"))
+ECON_WINDOW_MIN = int(os.getenv("ECON_WINDOW_MIN", "10"))
+ECON_TRANSFER_ALERT = int(os.getenv("ECON_TRANSFER_ALERT", "10"))  # 창 안에서 한 유저가 받은 송금 건수
+ECON_FAUCET_ALERT = int(os.getenv("ECON_FAUCET_ALERT", "5000"))  # 창 안에서 한 유저의 무상 유입 칩
+ECON_FLUSH_SEC = int(os.getenv("ECON_FLUSH_SEC", "60"))
+
 KST = timezone(timedelta(hours=9))
 
+DB_BUSY_TEXT = "DB 응답 지연으로 잠시 처리할 수 없습니다. 잠시 후 다시 시도해주세요."
+
 # =====================
 # 로깅
 # =====================
@@ -59,13 +141,158 @@ logging.basicConfig(
 )
 logger = logging.getLogger("badugi-bot")
 
+# =====================
+# 시작 단계별 소요 시간
+# =====================
+startup_phases: Dict[str, float] = {}
+
+
+@contextmanager
+def startup_phase(name: str) -> Iterator[None]:
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        startup_phases[name] = (time.perf_counter() - started) * 1000
+
+
+def log_startup_report():
+    total = (time.perf_counter() - _MODULE_STARTED) * 1000
+    logger.info(
+        "startup timing: %s total=%.1fms",
+        " ".join("{}={:.1f}ms".format(k, v) for k, v in startup_phases.items()),
+        total,
+    )
+
+
+def load_telegram():
+    # 텔레그램 관련 이름을 모듈 전역에 채움 (앱 생성 직전 1회)
+    global InlineKeyboardButton, InlineKeyboardMarkup, BadRequest, Forbidden, RetryAfter, ApplicationHandlerStop
+    from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+    from telegram.ext import ApplicationHandlerStop
+    from telegram.error import BadRequest, Forbidden, RetryAfter
+
+# =====================
+# 칩 경제 집계 (인메모리 분 단위 버킷)
+# =====================
+# 무상 지급 출처 — 이상 탐지 시 "공짜 칩" 유입으로 취급
+# bot_refill: 봇 좌석 스택(착석·파산 시 재충전)은 하우스가 새로 만드는 칩 → 봇에게 딴 칩은 유저 잔액으로 유입
+FAUCET_SOURCES = {"start", "join_bonus", "checkin", "giveaway", "admin", "bot_refill"}
+
+class ChipLedger:
+    def __init__(self):
+        # 분(epoch//60) → 출처 → [유입, 유출, 건수]
+        self.buckets: Dict[int, Dict[str, List[int]]] = {}
+        self._unflushed: Set[int] = set()
+        # 이상 탐지용 창: (분, 유저, 종류, 값) 이벤트와 유저별 누계
+        self._events: Deque[Tuple[int, int, str, int]] = deque()
+        self._window: Dict[Tuple[str, int], int] = {}
+        self._flagged: Set[Tuple[str, int]] = set()
+        self.alerts: Deque[str] = deque(maxlen=50)
+
+    def record(self, source: str, user_id: int, delta: int):
+        # 요청 경로에서 호출됨 → 메모리 연산만 수행
+        minute = int(time.time() // 60)
+        row = self.buckets.setdefault(minute, {}).setdefault(source, [0, 0, 0])
+        if delta >= 0:
+            row[0] += delta
+        else:
+            row[1] -= delta
+        row[2] += 1
+        self._unflushed.add(minute)
+
+        self._evict(minute)
+        if is_bot_id(user_id):
+            return  # 봇 좌석 스택은 버킷에만 집계 (유저별 이상 탐지 대상 아님)
+        if source == "transfer" and delta > 0:
+            self._track(minute, user_id, "transfer", 1, ECON_TRANSFER_ALERT, "송금 수신 {}건")
+        elif source in FAUCET_SOURCES and delta > 0:
+            self._track(minute, user_id, "faucet", delta, ECON_FAUCET_ALERT, "무상 유입 {}칩")
+
+    def _track(self, minute: int, user_id: int, kind: str, value: int, limit: int, label: str):
+        key = (kind, user_id)
+        self._events.append((minute, user_id, kind, value))
+        total = self._window.get(key, 0) + value
+        self._window[key] = total
+        if limit > 0 and total >= limit and key not in self._flagged:
+            self._flagged.add(key)
+            msg = "{} 유저 {}: 최근 {}분 {}".format(
+                datetime.now(KST).strftime("%m-%d %H:%M"), user_id, ECON_WINDOW_MIN, label.format(total)
+            )
+            self.alerts.append(msg)
+            logger.warning("칩 이상 징후 - %s", msg)
+
+    def _evict(self, minute: int):
+        oldest = minute - ECON_WINDOW_MIN
+        while self._events and self._events[0][0] <= oldest:
+            _, uid, kind, value = self._events.popleft()
+            key = (kind, uid)
+            left = self._window.get(key, 0) - value
+            if left > 0:
+                self._window[key] = left
+            else:
+                self._window.pop(key, None)
+                self._flagged.discard(key)
+
+    def series(self, minutes: int) -> List[Tuple[int, Dict[str, List[int]]]]:
+        now = int(time.time() // 60)
+        return [(m, self.buckets[m]) for m in range(now - minutes + 1, now + 1) if m in self.buckets]
+
+    def take_finished(self) -> List[Tuple[int, Dict[str, List[int]]]]:
+        # 지난 분의 버킷 중 아직 DB에 적재하지 않은 것 + 보관 기간 지난 버킷 정리
+        now = int(time.time() // 60)
+        done = sorted(m for m in self._unflushed if m < now)
+        self._unflushed.difference_update(done)
+        for m in [m for m in self.buckets if m < now - ECON_RETENTION_MIN]:
+            del self.buckets[m]
+        return [(m, self.buckets[m]) for m in done if m in self.buckets]
+
+economy = ChipLedger()
+
 # =====================
 # DB (MongoDB 또는 인메모리)
 # =====================
-try:
-    from motor.motor_asyncio import AsyncIOMotorClient
-except Exception:
-    AsyncIOMotorClient = None
+# 시작 시 생성하는 인덱스 (create_index 는 이미 있으면 그대로 둠)
+STORAGE_INDEXES: List[Tuple[str, List[Tuple[str, int]]]] = [
+    ("users", [("chips", -1)]),
+    ("users", [("last_played", 1)]),
+    ("bulk_jobs", [("status", 1)]),
+    ("checkin", [("last", 1)]),
+    ("admins", [("secondary", 1)]),
+]
+
+class CircuitBreaker:
+    # 연속으로 느리거나 실패한 DB 호출이 임계값에 닿으면 일정 시간 open → 그동안 쓰기는 큐로 우회
+    def __init__(self):
+        self.failures = 0
+        self.open_until = 0.0
+
+    @property
+    def state(self) -> str:
+        if time.monotonic() < self.open_until:
+            return "open"
+        return "half-open" if self.failures >= DB_BREAKER_THRESHOLD - 1 else "closed"
+
+    def allow(self) -> bool:
+        return time.monotonic() >= self.open_until
+
+    def record(self, elapsed_ms: float, ok: bool):
+        if ok and elapsed_ms < DB_SLOW_MS:
+            self.failures = 0
+            return
+        self.failures += 1
+        if self.failures >= DB_BREAKER_THRESHOLD:
+            self.open_until = time.monotonic() + DB_BREAKER_COOLDOWN_SEC
+            # half-open: 차단이 풀린 뒤 첫 호출이 다시 느리면 바로 재차단
+            self.failures = DB_BREAKER_THRESHOLD - 1
+            logger.warning("DB 회로 차단기 open (%.0fms) → %d초간 쓰기 대기열 사용", elapsed_ms, DB_BREAKER_COOLDOWN_SEC)
+
+def is_bot_id(user_id: int) -> bool:
+    # 봇 좌석은 음수 합성 user_id 사용 (텔레그램 유저 ID는 양수)
+    return user_id < 0
+
+def _mem_active(doc: Dict[str, Any], since: Optional[datetime]) -> bool:
+    return since is None or ("last_played" in doc and doc["last_played"] >= since)
 
 class Storage:
     def __init__(self):
@@ -75,54 +302,333 @@ class Storage:
         self._mem_checkin: Dict[int, str] = {}
         self._mem_last_give_user: Dict[int, datetime] = {}
         self._mem_last_give_chat: Dict[int, datetime] = {}
-        if MONGODB_URI and AsyncIOMotorClient is not None:
+        self._mem_bots: Dict[int, int] = {}  # 봇 칩은 항상 메모리에만 보관
+        self._mem_bulk_jobs: Dict[str, Dict[str, Any]] = {}
+        self.breaker = CircuitBreaker()
+        self._write_queue: Deque[Callable[[], Awaitable[Any]]] = deque()
+
+    async def bootstrap(self):
+        # 시작 시 1회: motor 지연 import + 클라이언트 생성 → ping 확인 → 인덱스 생성
+        # MONGODB_URI 가 설정돼 있으면 인메모리로 대체하지 않음 (임시 장부로 잔액이 갈라지는 것 방지)
+        # → 재시도 후에도 실패하면 기동 중단. 운영 중 장애는 회로 차단기가 처리
+        if not MONGODB_URI:
+            return
+        from motor.motor_asyncio import AsyncIOMotorClient
+
+        w: Any = int(MONGO_WRITE_CONCERN) if MONGO_WRITE_CONCERN.isdigit() else MONGO_WRITE_CONCERN
+        self._client = AsyncIOMotorClient(
+            MONGODB_URI,
+            maxPoolSize=MONGO_MAX_POOL,
+            minPoolSize=MONGO_MIN_POOL,
+            serverSelectionTimeoutMS=MONGO_TIMEOUT_MS,
+            connectTimeoutMS=MONGO_TIMEOUT_MS,
+            socketTimeoutMS=MONGO_TIMEOUT_MS,
+            w=w,
+        )
+        self._db = self._client["badugi_bot"]
+        for attempt in range(MONGO_CONNECT_RETRIES + 1):
+            started = time.perf_counter()
+            try:
+                await self._client.admin.command("ping")
+                break
+            except Exception as e:
+                if attempt == MONGO_CONNECT_RETRIES:
+                    raise RuntimeError("MongoDB 응답 없음 ({}회 시도) → 기동 중단: {}".format(attempt + 1, e)) from e
+                delay = min(30, 2 ** attempt)
+                logger.warning("MongoDB 응답 없음 → %d초 후 재시도 (%d/%d): %s", delay, attempt + 1, MONGO_CONNECT_RETRIES, e)
+                await asyncio.sleep(delay)
+        self.is_db = True
+        logger.info("MongoDB 연결 성공 (ping %.0fms)", (time.perf_counter() - started) * 1000)
+        for name, keys in STORAGE_INDEXES:
+            try:
+                await self._db[name].create_index(keys)
+            except Exception as e:
+                logger.warning("인덱스 생성 실패 %s %s: %s", name, keys, e)
+
+    async def _timed(self, op: Callable[[], Awaitable[Any]]) -> Any:
+        started = time.perf_counter()
+        try:
+            result = await op()
+        except Exception:
+            self.breaker.record((time.perf_counter() - started) * 1000, ok=False)
+            raise
+        self.breaker.record((time.perf_counter() - started) * 1000, ok=True)
+        return result
+
+    async def _read(self, op: Callable[[], Awaitable[Any]]) -> Any:
+        return await self._timed(op)
+
+    async def _write(self, op: Callable[[], Awaitable[Any]], critical: bool = True):
+        # 차단기가 열려 있거나 대기 중인 쓰기가 있으면(순서 보장) 큐에 넣고 바로 반환
+        if self.breaker.allow() and not self._write_queue:
+            await self._timed(op)
+            return
+        if not critical:
+            return
+        if len(self._write_queue) >= DB_WRITE_QUEUE_MAX:
+            logger.error("DB 쓰기 대기열 초과 → 쓰기 유실")
+            return
+        self._write_queue.append(op)
+
+    def writes_deferred(self) -> bool:
+        # 차단기 open 또는 대기 쓰기가 남아 있으면 DB 읽기가 최신 잔액/기록을 못 봄
+        # → 읽은 값에 의존하는 쓰기(출석·송금·참가 보너스·바이인)는 호출 측에서 거절
+        return self.is_db and (not self.breaker.allow() or bool(self._write_queue))
+
+    async def drain_writes(self):
+        # 백그라운드: 차단기가 닫히면 대기 쓰기를 순서대로 반영
+        while True:
+            if not self._write_queue or not self.breaker.allow():
+                await asyncio.sleep(0.2)
+                continue
+            op = self._write_queue[0]
             try:
-                self._client = AsyncIOMotorClient(MONGODB_URI)
-                self._db = self._client["badugi_bot"]
-                self.is_db = True
-                logger.info("MongoDB 연결 성공")
+                await self._timed(op)
             except Exception as e:
-                logger.warning("MongoDB 연결 실패 → 인메모리 사용: %s", e)
+                logger.warning("대기 쓰기 반영 실패: %s", e)
+            self._write_queue.popleft()
 
     async def ensure_user(self, user_id: int, username: str = ""):
+        if is_bot_id(user_id):
+            self._mem_bots.setdefault(user_id, BOT_STACK)
+            return
         if self.is_db:
             col = self._db["users"]
-            if not await col.find_one({"_id": user_id}):
-                await col.insert_one({"_id": user_id, "username": username, "chips": STARTING_CHIPS, "wins": 0, "games": 0})
-        else:
-            self._mem_users.setdefault(user_id, {"username": username, "chips": STARTING_CHIPS, "wins": 0, "games": 0})
+            if not await self._read(lambda: col.find_one({"_id": user_id})):
+                await self._write(lambda: col.insert_one({"_id": user_id, "username": username, "chips": STARTING_CHIPS, "wins": 0, "games": 0}))
+                economy.record("start", user_id, STARTING_CHIPS)
+        elif user_id not in self._mem_users:
+            self._mem_users[user_id] = {"username": username, "chips": STARTING_CHIPS, "wins": 0, "games": 0}
+            economy.record("start", user_id, STARTING_CHIPS)
 
     async def get_profile(self, user_id: int) -> Dict[str, Any]:
+        if is_bot_id(user_id):
+            return {"user_id": user_id, "username": "", "chips": self._mem_bots.get(user_id, BOT_STACK), "wins": 0, "games": 0}
         if self.is_db:
-            doc = await self._db["users"].find_one({"_id": user_id})
+            doc = await self._read(lambda: self._db["users"].find_one({"_id": user_id}))
             if not doc:
                 doc = {"username": "", "chips": STARTING_CHIPS, "wins": 0, "games": 0}
             return {"user_id": user_id, **doc}
         return {"user_id": user_id, **self._mem_users.get(user_id, {"username": "", "chips": STARTING_CHIPS, "wins": 0, "games": 0})}
 
-    async def add_chips(self, user_id: int, delta: int):
+    async def get_profiles(self, user_ids: List[int]) -> Dict[int, Dict[str, Any]]:
+        # 여러 유저를 한 번의 $in 조회로 가져옴 (없는 유저는 기본값)
+        out: Dict[int, Dict[str, Any]] = {}
+        if self.is_db:
+            docs = await self._read(lambda: self._db["users"].find({"_id": {"$in": user_ids}}).to_list(length=None))
+            for doc in docs:
+                out[doc["_id"]] = {"user_id": doc["_id"], **doc}
+        else:
+            for uid in user_ids:
+                if uid in self._mem_users:
+                    out[uid] = {"user_id": uid, **self._mem_users[uid]}
+        for uid in user_ids:
+            out.setdefault(uid, {"user_id": uid, "username": "", "chips": STARTING_CHIPS, "wins": 0, "games": 0})
+        return out
+
+    async def add_chips_many(self, user_ids: List[int], delta: int, source: str = ""):
+        if source:
+            for uid in user_ids:
+                economy.record(source, uid, delta)
+        if self.is_db:
+            await self._write(lambda: self._db["users"].update_many({"_id": {"$in": user_ids}}, {"$inc": {"chips": delta}}))
+        else:
+            for uid in user_ids:
+                await self.ensure_user(uid)
+                self._mem_users[uid]["chips"] = self._mem_users[uid].get("chips", STARTING_CHIPS) + delta
+
+    async def add_chips(self, user_id: int, delta: int, source: str = ""):
+        # source: 칩 경제 집계용 출처 태그(join_bonus/checkin/giveaway/transfer/ante/bet/pot/admin/bulk)
+        if is_bot_id(user_id):
+            self._mem_bots[user_id] = self._mem_bots.get(user_id, BOT_STACK) + delta
+            return
+        if source:
+            economy.record(source, user_id, delta)
         if self.is_db:
-            await self._db["users"].update_one({"_id": user_id}, {"$inc": {"chips": delta}})
+            await self._write(lambda: self._db["users"].update_one({"_id": user_id}, {"$inc": {"chips": delta}}))
         else:
             await self.ensure_user(user_id)
             self._mem_users[user_id]["chips"] = self._mem_users[user_id].get("chips", STARTING_CHIPS) + delta
 
-    async def record_game(self, user_id: int, win: bool):
+    async def record_game(self, user_id: int, win: bool, stats: Optional[Dict[str, int]] = None):
+        # stats: 한 판의 집계 증분 → 누적(stats.*)과 일별 버킷(daily.<날짜>.*)을 같은 쓰기로 반영
+        if is_bot_id(user_id):
+            return
+        stats = dict(stats or {})
+        best_pot = stats.pop("best_pot", 0)
+        day = datetime.now(KST).strftime("%Y-%m-%d")
+        inc: Dict[str, int] = {"games": 1}
+        if win:
+            inc["wins"] = 1
+        for k, v in stats.items():
+            if v:
+                inc["stats.{}".format(k)] = v
+                inc["daily.{}.{}".format(day, k)] = v
+        mx: Dict[str, int] = {}
+        if best_pot > 0:
+            mx = {"stats.best_pot": best_pot, "daily.{}.best_pot".format(day): best_pot}
+        now = datetime.now(timezone.utc)
         if self.is_db:
-            inc = {"games": 1}
-            if win:
-                inc["wins"] = 1
-            await self._db["users"].update_one({"_id": user_id}, {"$inc": inc})
+            update: Dict[str, Any] = {"$inc": inc, "$set": {"last_played": now}}
+            if mx:
+                update["$max"] = mx
+            await self._write(lambda: self._db["users"].update_one({"_id": user_id}, update))
         else:
             await self.ensure_user(user_id)
-            self._mem_users[user_id]["games"] = self._mem_users[user_id].get("games", 0) + 1
-            if win:
-                self._mem_users[user_id]["wins"] = self._mem_users[user_id].get("wins", 0) + 1
+            doc = self._mem_users[user_id]
+            doc["last_played"] = now
+            for path, v in inc.items():
+                _mem_apply(doc, path, v, max_only=False)
+            for path, v in mx.items():
+                _mem_apply(doc, path, v, max_only=True)
+
+    async def save_economy_buckets(self, rows: List[Tuple[int, Dict[str, List[int]]]]):
+        # 분 단위 칩 경제 버킷 적재(백그라운드 전용)
+        if not self.is_db or not rows:
+            return
+        col = self._db["economy"]
+        for minute, sources in rows:
+            inc: Dict[str, int] = {}
+            for src, (inflow, outflow, n) in sources.items():
+                inc["{}.in".format(src)] = inflow
+                inc["{}.out".format(src)] = outflow
+                inc["{}.n".format(src)] = n
+            await self._write(lambda m=minute, i=inc: col.update_one({"_id": m}, {"$inc": i}, upsert=True), critical=False)
+
+    async def save_rooms(self, snapshots: List[Dict[str, Any]]) -> int:
+        # 종료 시 방 상태 저장 → 다음 프로세스가 load_rooms 로 이어받음 (인메모리 모드는 저장 불가)
+        if not self.is_db:
+            return 0
+        col = self._db["rooms"]
+        await col.delete_many({})
+        if snapshots:
+            await col.insert_many(snapshots)
+        return len(snapshots)
+
+    async def load_rooms(self) -> List[Dict[str, Any]]:
+        if not self.is_db:
+            return []
+        col = self._db["rooms"]
+        docs = [doc async for doc in col.find({})]
+        await col.delete_many({})
+        return docs
+
+    async def flush_writes(self, timeout: float) -> int:
+        # 대기열의 쓰기가 모두 반영될 때까지 기다림; 남은 건수 반환
+        deadline = time.monotonic() + timeout
+        while self._write_queue and time.monotonic() < deadline:
+            await asyncio.sleep(0.2)
+        return len(self._write_queue)
+
+    # 관리자 일괄 작업: 라이브 트래픽과 섞이지 않도록 차단기 집계(_timed)·쓰기 대기열을 거치지 않음
+    def write_backlog(self) -> int:
+        return len(self._write_queue)
+
+    async def count_users(self, active_since: Optional[datetime] = None) -> int:
+        query: Dict[str, Any] = {"last_played": {"$gte": active_since}} if active_since else {}
+        if self.is_db:
+            return await self._db["users"].count_documents(query)
+        return sum(1 for doc in self._mem_users.values() if _mem_active(doc, active_since))
+
+    async def scan_users(self, after_id: Optional[int], limit: int, active_since: Optional[datetime] = None) -> List[Dict[str, Any]]:
+        # _id 오름차순으로 after_id 다음부터 한 배치 (재개 지점 = 마지막 _id)
+        query: Dict[str, Any] = {"_id": {"$gt": after_id}} if after_id is not None else {}
+        if active_since:
+            query["last_played"] = {"$gte": active_since}
+        if self.is_db:
+            cur = self._db["users"].find(query, projection={"chips": 1}, sort=[("_id", 1)], limit=limit)
+            return [doc async for doc in cur]
+        ids = sorted(
+            uid for uid, doc in self._mem_users.items()
+            if (after_id is None or uid > after_id) and _mem_active(doc, active_since)
+        )
+        return [{"_id": uid, "chips": self._mem_users[uid].get("chips", STARTING_CHIPS)} for uid in ids[:limit]]
+
+    async def bulk_add_chips(self, job_id: str, ops: List[Tuple[int, int, Optional[int]]]) -> List[int]:
+        # ops: (유저, 증감, 기대 잔액) — last_bulk 표식으로 재개 시 같은 배치 중복 반영 방지,
+        # 기대 잔액이 있으면 그 사이 게임으로 잔액이 바뀐 유저는, 차감은 잔액이 모자란 유저는 건너뜀.
+        # 이번 호출에서 실제로 반영된 유저 목록 반환 (재개 전에 이미 반영된 유저는 제외)
+        if not ops:
+            return []
+        if self.is_db:
+            from pymongo import UpdateOne
+
+            col = self._db["users"]
+            ids = [uid for uid, _, _ in ops]
+            marked = {"_id": {"$in": ids}, "last_bulk": job_id}
+            before = {doc["_id"] for doc in await col.find(marked, projection={"_id": 1}).to_list(length=None)}
+            requests = []
+            for uid, delta, expect in ops:
+                if uid in before:
+                    continue
+                flt: Dict[str, Any] = {"_id": uid, "last_bulk": {"$ne": job_id}}
+                if expect is not None:
+                    flt["chips"] = expect
+                elif delta < 0:
+                    flt["chips"] = {"$gte": -delta}
+                requests.append(UpdateOne(flt, {"$inc": {"chips": delta}, "$set": {"last_bulk": job_id}}))
+            if requests:
+                await col.bulk_write(requests, ordered=False)
+            after = await col.find(marked, projection={"_id": 1}).to_list(length=None)
+            return [doc["_id"] for doc in after if doc["_id"] not in before]
+        applied: List[int] = []
+        for uid, delta, expect in ops:
+            doc = self._mem_users.get(uid)
+            if doc is None or doc.get("last_bulk") == job_id:
+                continue
+            chips = doc.get("chips", STARTING_CHIPS)
+            if (expect is not None and chips != expect) or (expect is None and chips + delta < 0):
+                continue
+            doc["chips"] = chips + delta
+            doc["last_bulk"] = job_id
+            applied.append(uid)
+        return applied
+
+    async def save_bulk_job(self, job: Dict[str, Any]):
+        if self.is_db:
+            await self._db["bulk_jobs"].replace_one({"_id": job["_id"]}, job, upsert=True)
+        else:
+            self._mem_bulk_jobs[job["_id"]] = dict(job)
+
+    async def load_bulk_jobs(self, status: str) -> List[Dict[str, Any]]:
+        if self.is_db:
+            return [doc async for doc in self._db["bulk_jobs"].find({"status": status}, sort=[("created", 1)])]
+        return [dict(job) for job in self._mem_bulk_jobs.values() if job["status"] == status]
+
+    async def compact_daily_stats(self, keep_days: int) -> int:
+        # 보관 기간이 지난 일별 버킷을 월별 버킷(monthly.<YYYY-MM>.*)으로 합치고 삭제
+        cutoff = (datetime.now(KST) - timedelta(days=keep_days)).strftime("%Y-%m-%d")
+        compacted = 0
+        if self.is_db:
+            col = self._db["users"]
+            async for doc in col.find({"daily": {"$exists": True}}, projection={"daily": 1}):
+                inc, mx, old_days = fold_daily_buckets(doc.get("daily") or {}, cutoff)
+                if not old_days:
+                    continue
+                update: Dict[str, Any] = {"$unset": {"daily.{}".format(d): "" for d in old_days}}
+                if inc:
+                    update["$inc"] = inc
+                if mx:
+                    update["$max"] = mx
+                await self._write(lambda uid=doc["_id"], u=update: col.update_one({"_id": uid}, u))
+                compacted += 1
+            return compacted
+        for doc in self._mem_users.values():
+            inc, mx, old_days = fold_daily_buckets(doc.get("daily") or {}, cutoff)
+            if not old_days:
+                continue
+            for path, v in inc.items():
+                _mem_apply(doc, path, v, max_only=False)
+            for path, v in mx.items():
+                _mem_apply(doc, path, v, max_only=True)
+            for d in old_days:
+                doc["daily"].pop(d, None)
+            compacted += 1
+        return compacted
 
     async def top_rank(self, limit: int = 10):
         if self.is_db:
-            cur = self._db["users"].find({}, sort=[("chips", -1)], limit=limit)
-            return [doc async for doc in cur]
+            return await self._read(lambda: self._db["users"].find({}, sort=[("chips", -1)], limit=limit).to_list(length=limit))
         rows = [{"_id": uid, **d} for uid, d in self._mem_users.items()]
         rows.sort(key=lambda x: x.get("chips", 0), reverse=True)
         return rows[:limit]
@@ -133,17 +639,23 @@ class Storage:
         s = await self.get_profile(sender)
         if s["chips"] < amount:
             return False
-        await self.add_chips(sender, -amount)
+        await self.add_chips(sender, -amount, source="transfer")
         await self.ensure_user(receiver)
-        await self.add_chips(receiver, +amount)
+        await self.add_chips(receiver, +amount, source="transfer")
         return True
 
     # 관리자
+    def reset_bot(self, user_id: int, chips: Optional[int] = None):
+        if chips is None:
+            self._mem_bots.pop(user_id, None)
+        else:
+            self._mem_bots[user_id] = chips
+
     async def set_secondary_admin(self, target_id: int):
         if target_id == PRIMARY_ADMIN_ID:
             return
         if self.is_db:
-            await self._db["admins"].update_one({"_id": target_id}, {"$set": {"secondary": True}}, upsert=True)
+            await self._write(lambda: self._db["admins"].update_one({"_id": target_id}, {"$set": {"secondary": True}}, upsert=True))
         else:
             self._mem_admins.add(target_id)
 
@@ -154,7 +666,7 @@ class Storage:
         if await self.is_primary_admin(user_id):
             return True
         if self.is_db:
-            doc = await self._db["admins"].find_one({"_id": user_id})
+            doc = await self._read(lambda: self._db["admins"].find_one({"_id": user_id}))
             return bool(doc and doc.get("secondary"))
         return user_id in self._mem_admins
 
@@ -162,7 +674,7 @@ class Storage:
     async def can_checkin(self, user_id: int) -> bool:
         today = datetime.now(KST).strftime("%Y-%m-%d")
         if self.is_db:
-            doc = await self._db["checkin"].find_one({"_id": user_id})
+            doc = await self._read(lambda: self._db["checkin"].find_one({"_id": user_id}))
             last = doc.get("last", "") if doc else ""
             return last != today
         return self._mem_checkin.get(user_id, "") != today
@@ -170,7 +682,7 @@ class Storage:
     async def mark_checkin(self, user_id: int):
         today = datetime.now(KST).strftime("%Y-%m-%d")
         if self.is_db:
-            await self._db["checkin"].update_one({"_id": user_id}, {"$set": {"last": today}}, upsert=True)
+            await self._write(lambda: self._db["checkin"].update_one({"_id": user_id}, {"$set": {"last": today}}, upsert=True))
         else:
             self._mem_checkin[user_id] = today
 
@@ -190,6 +702,34 @@ class Storage:
         self._mem_last_give_user[user_id] = now
         self._mem_last_give_chat[chat_id] = now
 
+
+def _mem_apply(doc: Dict[str, Any], path: str, value: int, max_only: bool):
+    # 인메모리 모드에서 Mongo의 점(.) 경로 $inc/$max 를 흉내냄
+    keys = path.split(".")
+    for k in keys[:-1]:
+        doc = doc.setdefault(k, {})
+    last = keys[-1]
+    if max_only:
+        doc[last] = max(doc.get(last, 0), value)
+    else:
+        doc[last] = doc.get(last, 0) + value
+
+
+def fold_daily_buckets(daily: Dict[str, Dict[str, int]], cutoff: str) -> Tuple[Dict[str, int], Dict[str, int], List[str]]:
+    # cutoff(YYYY-MM-DD) 이전 일별 버킷 → 월별 증분($inc), 최대값($max), 삭제할 날짜 목록
+    inc: Dict[str, int] = {}
+    mx: Dict[str, int] = {}
+    old_days = sorted(d for d in daily if d < cutoff)
+    for d in old_days:
+        month = d[:7]
+        for k, v in (daily.get(d) or {}).items():
+            path = "monthly.{}.{}".format(month, k)
+            if k == "best_pot":
+                mx[path] = max(mx.get(path, 0), v)
+            else:
+                inc[path] = inc.get(path, 0) + v
+    return inc, mx, old_days
+
 storage = Storage()
 
 # =====================
@@ -208,6 +748,11 @@ class Player:
     current_bet: int = 0
     total_put: int = 0
     all_in: bool = False
+    vpip: bool = False  # 이번 판 자발적으로 칩을 넣었는지(콜/레이즈)
+    fold_street: str = ""  # 폴드한 배팅 라운드(BET1/BET2/BET3)
+    is_bot: bool = False
+    ante_paid: int = 0  # 이번 판에 낸 앤티 (중단 시 환불용)
+    stack: Optional[int] = None  # 판 진행 중 보유칩 캐시 (판 시작 시 1회 조회)
 
 @dataclass
 class GameRoom:
@@ -225,10 +770,32 @@ class GameRoom:
 
     turn_order: List[int] = field(default_factory=list)
     current_bet: int = 0
+    last_aggressor: Optional[int] = None  # 이번 배팅 라운드 마지막 레이즈한 플레이어
 
     awaiting_user: Optional[int] = None
     awaiting_custom_raise: Optional[int] = None
 
+    # 동시 교환: 선택 결과 / 응답 대기 인원 / 전원 응답 신호
+    exchange_choices: Dict[int, int] = field(default_factory=dict)
+    exchange_pending: Set[int] = field(default_factory=set)
+    exchange_done: Optional[asyncio.Event] = None
+
+    # 토너먼트 테이블 전용: 소속 토너먼트 / 테이블 번호 / 다음 판부터 앉을 이동 인원
+    tournament: Optional["Tournament"] = None
+    table_no: int = 0
+    incoming: List[Player] = field(default_factory=list)
+
+    # 로비 참가 요청 묶음 처리: 대기 중인 콜백 쿼리 / 처리 태스크 / 갱신할 로비 메시지
+    join_queue: List[Any] = field(default_factory=list)
+    join_task: Optional["asyncio.Task[Any]"] = None
+    lobby_message: Any = None
+
+    # 쇼다운에서 아직 지급하지 않은 (승자, 칩) — 지급 도중 종료되면 드레인이 나머지를 지급
+    unpaid: List[Tuple[int, int]] = field(default_factory=list)
+
+    def tag(self) -> str:
+        return "[T{}] ".format(self.table_no) if self.tournament is not None else ""
+
     def make_deck(self):
         self.deck = [(r, s) for s in SUITS for r in RANKS]
         random.shuffle(self.deck)
@@ -241,7 +808,35 @@ class GameRoom:
             out.append(self.deck.pop())
         return out
 
+@dataclass
+class Tournament:
+    chat_id: int
+    host_id: int
+    buy_in: int
+    state: str = "REG"  # REG, RUNNING, DONE
+    entrants: Dict[int, str] = field(default_factory=dict)  # user_id → 이름
+    stacks: Dict[int, int] = field(default_factory=dict)  # 토너먼트 칩 (메모리, users.chips 와 별개)
+    tables: Dict[int, GameRoom] = field(default_factory=dict)
+    busted: List[int] = field(default_factory=list)  # 탈락 순서
+    level: int = 1
+    ante: int = TOUR_ANTE_START
+
+    def seated(self, table: GameRoom) -> int:
+        return len(table.players) + len(table.incoming)
+
+    def remaining(self) -> int:
+        return sum(self.seated(t) for t in self.tables.values())
+
 rooms: Dict[int, GameRoom] = {}
+tournaments: Dict[int, Tournament] = {}
+
+# 진행 중인 판: user_id → 앉아 있는 방 (DM 버튼/입력 라우팅용)
+player_rooms: Dict[int, GameRoom] = {}
+# 실행 중인 판/테이블 태스크
+hand_tasks: Set["asyncio.Task[Any]"] = set()
+# 종료 드레인 중: 새 로비/판/토너먼트를 받지 않음
+draining = False
+drain_task: Optional["asyncio.Task[Any]"] = None
 
 # (chat_id, user_id) → 사용자 입력 레이즈 대기 플래그
 pending_custom_raise: Set[Tuple[int, int]] = set()
@@ -286,6 +881,297 @@ def heuristic_discards(hand: List[Tuple[str, str]], count: int) -> List[int]:
     scored.sort(reverse=True)
     return [i for _, i in scored[:count]]
 
+# =====================
+# 봇 플레이어 (사전 계산된 패 강도 테이블)
+# =====================
+STRENGTH_TABLE_VERSION = 1  # build_strength_table / badugi_rank_key 가 바뀌면 올림
+_strength_table: Optional[Sequence[float]] = None
+_next_bot_id = -1
+
+
+def badugi_mask(hand: List[Tuple[str, str]]) -> int:
+    # 바둑이 구성 카드 랭크의 비트마스크 (장수 = popcount)
+    m = 0
+    for v in badugi_rank_key(hand)[1]:
+        m |= 1 << v
+    return m
+
+
+def build_strength_table() -> List[float]:
+    # 52장 중 4장 조합 전체를 badugi_rank_key 순서로 줄세워 마스크별 "이기는 비율"을 계산
+    counts = [0] * 8192
+    deck = [(r, s) for s in SUITS for r in RANKS]
+    for combo in itertools.combinations(deck, 4):
+        counts[badugi_mask(list(combo))] += 1
+    total = sum(counts)
+
+    def order(m: int):
+        ranks = [v for v in range(13) if m >> v & 1]
+        return (-len(ranks), ranks)
+
+    table = [0.0] * 8192
+    worse = 0
+    for m in sorted((m for m in range(8192) if counts[m]), key=order, reverse=True):
+        table[m] = (worse + counts[m] / 2.0) / total
+        worse += counts[m]
+    return table
+
+
+# 캐시 파일 헤더: 매직, 버전, 항목 수, 본문 sha256 — 본문은 float32 배열
+_TABLE_MAGIC = b"BDGT"
+_TABLE_HEADER = struct.Struct("<4sII32s")
+
+
+def load_cached_table(name: str, version: int, count: int, build: Callable[[], List[float]]) -> Sequence[float]:
+    # 캐시 파일을 mmap 으로 열어 복사 없이 사용; 헤더/체크섬이 맞지 않으면 재생성 후 저장
+    path = os.path.join(CACHE_DIR, "{}_v{}.bin".format(name, version))
+    try:
+        with open(path, "rb") as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, ver, n, digest = _TABLE_HEADER.unpack_from(mm, 0)
+        payload = memoryview(mm)[_TABLE_HEADER.size:]
+        if (magic, ver, n) == (_TABLE_MAGIC, version, count) and len(payload) == 4 * count \
+                and hashlib.sha256(payload).digest() == digest:
+            return payload.cast("f")
+        logger.warning("테이블 캐시 불일치 → 재생성: %s", path)
+    except FileNotFoundError:
+        pass
+    except (OSError, ValueError, struct.error) as e:
+        logger.warning("테이블 캐시 읽기 실패 → 재생성: %s (%s)", path, e)
+
+    started = time.perf_counter()
+    table = array("f", build())
+    logger.info("테이블 생성 %s: %.0fms", name, (time.perf_counter() - started) * 1000)
+    payload_bytes = table.tobytes()
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(_TABLE_HEADER.pack(_TABLE_MAGIC, version, count, hashlib.sha256(payload_bytes).digest()))
+            f.write(payload_bytes)
+        os.replace(tmp, path)
+    except OSError as e:
+        logger.warning("테이블 캐시 저장 실패: %s (%s)", path, e)
+    return table
+
+
+def strength_table() -> Sequence[float]:
+    global _strength_table
+    if _strength_table is None:
+        _strength_table = load_cached_table("strength", STRENGTH_TABLE_VERSION, 8192, build_strength_table)
+    return _strength_table
+
+
+def bot_exchange_count(hand: List[Tuple[str, str]]) -> int:
+    key = badugi_rank_key(hand)
+    made = -key[0]
+    if made < 4:
+        return 4 - made
+    # 바둑이 완성이어도 최고 카드가 T 이상이면 1장 교체
+    return 1 if key[1][-1] >= RANK_VALUE["T"] else 0
+
+
+def bot_decide(hand: List[Tuple[str, str]], phase: str, need: int, mychips: int, already_bet: int) -> Tuple[str, int]:
+    # 반환: ("call" | "fold" | "raise", 레이즈 금액)
+    s = strength_table()[badugi_mask(hand)]
+    s += {"BET1": 0.15, "BET2": 0.08}.get(phase, 0.0)  # 남은 교환 기회만큼 가산
+    s += random.uniform(-0.05, 0.05)
+    if need >= mychips:
+        return ("call", 0) if s > 0.8 else ("fold", 0)
+    if s > 0.85 and already_bet == 0:
+        affordable = [amt for amt in RAISE_CHOICES if mychips >= need + amt]
+        if affordable:
+            return "raise", affordable[-1] if s > 0.95 else affordable[0]
+    if need == 0 or s > 0.45:
+        return "call", 0
+    return "fold", 0
+
+
+def add_bot(room: "GameRoom") -> Optional[Player]:
+    global _next_bot_id
+    if len(room.players) >= MAX_PLAYERS:
+        return None
+    strength_table()
+    pid = _next_bot_id
+    _next_bot_id -= 1
+    bot = Player(user_id=pid, username="🤖봇{}".format(-pid), is_bot=True)
+    storage.reset_bot(pid, BOT_STACK)
+    economy.record("bot_refill", pid, BOT_STACK)
+    room.players[pid] = bot
+    return bot
+
+
+def remove_bot(room: "GameRoom") -> bool:
+    for pid, p in list(room.players.items()):
+        if p.is_bot:
+            del room.players[pid]
+            storage.reset_bot(pid)
+            return True
+    return False
+
+
+def fill_with_bots(room: "GameRoom", target: int) -> int:
+    added = 0
+    while len(room.players) < target and add_bot(room):
+        added += 1
+    return added
+
+
+async def bot_act(context: ContextTypes.DEFAULT_TYPE, room: "GameRoom", p: Player, need: int, mychips: int):
+    action, amount = bot_decide(p.hand, room.state, need, mychips, p.current_bet)
+    room.awaiting_user = p.user_id
+    if action == "raise":
+        await handle_raise(context, room, p.user_id, amount)
+    elif action == "call":
+        await handle_call(context, room, p.user_id)
+    else:
+        await handle_fold(context, room, p.user_id)
+
+# =====================
+# 입력 속도 제한 & 과부하 감지
+# =====================
+class RateLimiter:
+    # 키별 토큰 버킷 — 메모리 연산만 하므로 저장소 접근 전에 호출
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self._buckets: Dict[int, Tuple[float, float]] = {}  # key → (토큰, 마지막 갱신)
+
+    def allow(self, key: int) -> bool:
+        now = time.monotonic()
+        tokens, ts = self._buckets.get(key, (float(self.burst), now))
+        tokens = min(float(self.burst), tokens + (now - ts) * self.rate)
+        if tokens < 1.0:
+            self._buckets[key] = (tokens, now)
+            return False
+        self._buckets[key] = (tokens - 1.0, now)
+        return True
+
+    def prune(self):
+        # 이미 가득 찬 버킷은 기본값과 같으므로 삭제
+        now = time.monotonic()
+        for key, (tokens, ts) in list(self._buckets.items()):
+            if tokens + (now - ts) * self.rate >= self.burst:
+                del self._buckets[key]
+
+
+class LoadMonitor:
+    # 이벤트 루프 지연(EWMA)이 기준을 넘으면 과부하 — 비게임 명령부터 처리 중단
+    def __init__(self):
+        self.lag_ms = 0.0
+        self.overloaded = False
+
+    async def run(self, interval: float = 0.5):
+        loop = asyncio.get_running_loop()
+        ticks = 0
+        while True:
+            started = loop.time()
+            await asyncio.sleep(interval)
+            lag = max(0.0, (loop.time() - started - interval) * 1000)
+            self.lag_ms = 0.7 * self.lag_ms + 0.3 * lag
+            if not self.overloaded and self.lag_ms > LOOP_LAG_THRESHOLD_MS:
+                self.overloaded = True
+                logger.warning("과부하 모드 진입 (루프 지연 %.0fms)", self.lag_ms)
+            elif self.overloaded and self.lag_ms < LOOP_LAG_THRESHOLD_MS / 2:
+                self.overloaded = False
+                logger.info("과부하 모드 해제 (루프 지연 %.0fms)", self.lag_ms)
+            ticks += 1
+            if ticks % 120 == 0:
+                user_limiter.prune()
+                chat_limiter.prune()
+
+
+user_limiter = RateLimiter(RATE_USER_PER_SEC, RATE_USER_BURST)
+chat_limiter = RateLimiter(RATE_CHAT_PER_SEC, RATE_CHAT_BURST)
+load_monitor = LoadMonitor()
+
+
+def admit(chat_id: int, user_id: int) -> bool:
+    return user_limiter.allow(user_id) and chat_limiter.allow(chat_id)
+
+# =====================
+# 타이머 스케줄러 (힙 하나로 모든 블라인드 타이머 관리)
+# =====================
+class TimerScheduler:
+    def __init__(self):
+        self._heap: List[Tuple[float, int, Callable[[], Awaitable[Any]]]] = []
+        self._seq = itertools.count()
+        self._wakeup: Optional[asyncio.Event] = None
+
+    def schedule(self, delay: float, callback: Callable[[], Awaitable[Any]]):
+        loop = asyncio.get_running_loop()
+        heapq.heappush(self._heap, (loop.time() + delay, next(self._seq), callback))
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def run(self):
+        self._wakeup = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        while True:
+            now = loop.time()
+            while self._heap and self._heap[0][0] <= now:
+                _, _, callback = heapq.heappop(self._heap)
+                loop.create_task(self._fire(callback))
+            timeout = self._heap[0][0] - now if self._heap else None
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    async def _fire(self, callback: Callable[[], Awaitable[Any]]):
+        try:
+            await callback()
+        except Exception:
+            logger.exception("타이머 콜백 실패")
+
+scheduler = TimerScheduler()
+
+# =====================
+# 방별 칩 접근 (캐시 게임: users.chips / 토너먼트: 메모리 스택)
+# =====================
+async def room_chips(room: GameRoom, pid: int, fresh: bool = False) -> int:
+    # 캐시(p.stack)는 프롬프트·버튼 표시용; 실제 차감 전에는 fresh=True 로 잔액을 다시 읽음
+    if room.tournament is not None:
+        return room.tournament.stacks.get(pid, 0)
+    p = room.players.get(pid)
+    if p is not None and p.stack is not None and (not fresh or storage.writes_deferred()):
+        # 쓰기가 대기열에 있으면 DB 잔액이 오래된 값 → 자기 증감이 반영된 캐시를 사용
+        return p.stack
+    prof = await storage.get_profile(pid)
+    if p is not None and p.stack is not None:
+        p.stack = prof["chips"]
+    return prof["chips"]
+
+
+async def room_add_chips(room: GameRoom, pid: int, delta: int, source: str = ""):
+    p = room.players.get(pid)
+    if p is not None and p.stack is not None:
+        p.stack += delta
+    if room.tournament is not None:
+        room.tournament.stacks[pid] = room.tournament.stacks.get(pid, 0) + delta
+        return
+    await storage.add_chips(pid, delta, source=source)
+
+
+def seat_players(room: GameRoom):
+    for pid in room.players:
+        player_rooms[pid] = room
+
+
+def unseat_players(room: GameRoom):
+    for pid in list(player_rooms):
+        if player_rooms[pid] is room:
+            del player_rooms[pid]
+
+
+def spawn_hand(context: ContextTypes.DEFAULT_TYPE, coro: Awaitable[Any]) -> "asyncio.Task[Any]":
+    # 판 진행은 별도 태스크로 실행해야 진행 중에도 버튼 업데이트가 처리됨
+    task = context.application.create_task(coro)
+    hand_tasks.add(task)
+    task.add_done_callback(hand_tasks.discard)
+    return task
+
 # =====================
 # 콜백 키
 # =====================
@@ -296,6 +1182,9 @@ CB_FOLD = "fold"
 CB_RAISE = "raise_"  # 뒤에 금액 또는 allin
 CB_RAISE_CUSTOM = "raise_custom"
 CB_EXC = {i: "exch_{}".format(i) for i in range(5)}
+CB_TOUR_JOIN = "tour_join"
+CB_TOUR_START = "tour_start"
+CB_TOUR_CANCEL = "tour_cancel"
 
 # =====================
 # 명령어 & 한글 텍스트 트리거
@@ -309,7 +1198,7 @@ async def cmd_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 -바둑이 로 로비를 만들거나 참가하세요. (예: -바둑이, -바둑이 500)
 
--출석(하루 1회 +{}칩)  -내정보  -랭킹  -송금 <상대ID> <금액>
+-출석(하루 1회 +{}칩)  -내정보  -통계  -랭킹  -송금 <상대ID> <금액>
 
 보유 칩: {}개
 """.format(user.mention_html(), CHECKIN_REWARD, prof.get('chips', 0))
@@ -331,6 +1220,42 @@ async def cmd_info(update: Update, context: ContextTypes.DEFAULT_TYPE):
 """.format(user.mention_html(), prof.get('chips', 0), wins, losses, games, wr)
     await update.message.reply_text(message, parse_mode="HTML")
 
+async def cmd_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user = update.effective_user
+    await storage.ensure_user(user.id, user.username or user.full_name)
+    prof = await storage.get_profile(user.id)
+    st = prof.get("stats") or {}
+    hands = st.get("hands", 0)
+    showdowns = st.get("showdowns", 0)
+
+    def pct(n: int, d: int) -> float:
+        return round(100.0 * n / d, 1) if d > 0 else 0.0
+
+    today = datetime.now(KST).strftime("%Y-%m-%d")
+    month = today[:7]
+    today_net = (prof.get("daily") or {}).get(today, {}).get("net", 0)
+    month_net = (prof.get("monthly") or {}).get(month, {}).get("net", 0)
+    for day, bucket in (prof.get("daily") or {}).items():
+        if day.startswith(month):
+            month_net += bucket.get("net", 0)
+    message = """
+📊 {} 통계
+플레이: {}판 / 쇼다운 {}회
+순이익: {}칩 (오늘 {} / 이번달 {})
+VPIP: {}%
+폴드율: 1차 {}% / 2차 {}% / 3차 {}%
+최대 획득 팟: {}칩
+바둑이 완성률: {}%
+""".format(
+        user.mention_html(), hands, showdowns,
+        st.get("net", 0), today_net, month_net,
+        pct(st.get("vpip", 0), hands),
+        pct(st.get("fold_BET1", 0), hands), pct(st.get("fold_BET2", 0), hands), pct(st.get("fold_BET3", 0), hands),
+        st.get("best_pot", 0),
+        pct(st.get("badugis", 0), showdowns),
+    )
+    await update.message.reply_text(message, parse_mode="HTML")
+
 async def cmd_rank(update: Update, context: ContextTypes.DEFAULT_TYPE):
     top = await storage.top_rank(10)
     lines = ["🏆 칩 랭킹 Top 10"]
@@ -351,20 +1276,82 @@ async def cmd_transfer(update: Update, context: ContextTypes.DEFAULT_TYPE):
     except ValueError:
         await update.message.reply_text("숫자를 올바르게 입력해주세요.")
         return
+    if storage.writes_deferred():
+        await update.message.reply_text(DB_BUSY_TEXT)
+        return
+    seated = player_rooms.get(user.id)
+    if seated is not None and seated.tournament is None:
+        await update.message.reply_text("게임 진행 중에는 송금할 수 없습니다. 판이 끝난 뒤 다시 시도해주세요.")
+        return
     ok = await storage.transfer(user.id, target, amount)
     await update.message.reply_text("✅ 송금 완료" if ok else "❌ 송금 실패 (잔액 부족/잘못된 금액)")
 
 async def cmd_checkin(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     await storage.ensure_user(user.id, user.username or user.full_name)
+    if storage.writes_deferred():
+        await update.message.reply_text(DB_BUSY_TEXT)
+        return
     if await storage.can_checkin(user.id):
-        await storage.add_chips(user.id, CHECKIN_REWARD)
+        await storage.add_chips(user.id, CHECKIN_REWARD, source="checkin")
         await storage.mark_checkin(user.id)
         await update.message.reply_text("🎁 출석 체크 완료! +{}칩 지급".format(CHECKIN_REWARD))
     else:
         await update.message.reply_text("오늘은 이미 출석하셨습니다. 내일 다시 시도해주세요.")
 
 # ========= 한글 텍스트 트리거 =========
+# 과부하 시 먼저 중단하는 비게임 명령 / 항상 처리하는 게임·관리 명령
+NON_GAME_COMMANDS = {
+    "내정보", "정보", "프로필", "통계", "상세전적", "랭킹", "순위", "랭크",
+    "출석", "출첵", "출석체크", "송금", "보내기", "이체", "경제", "칩통계",
+}
+GAME_COMMANDS = {
+    "바둑이", "게임시작", "로비", "강제초기화", "초기화", "리셋",
+    "토너먼트", "토너", "봇", "봇추가", "관리자임명", "관리자", "어드민",
+    "프로파일", "프로파일링", "일괄", "일괄작업",
+}
+# 영문 슬래시 명령도 같은 기준으로 분류
+NON_GAME_SLASH = {"start", "myinfo", "stats", "rank", "transfer", "checkin", "economy"}
+GAME_SLASH = {"forcereset", "setadmin", "profile", "bulk", "badugi", "tournament"}
+
+
+def command_kind(text: Optional[str]) -> Optional[str]:
+    # "game" / "non_game" / None(명령이 아닌 일반 메시지)
+    text = (text or "").strip()
+    if text.startswith("/"):
+        parts = text[1:].split(maxsplit=1)
+        name = parts[0].split("@")[0] if parts else ""
+        if name in NON_GAME_SLASH:
+            return "non_game"
+        return "game" if name in GAME_SLASH else None
+    if text.startswith("-"):
+        text = text[1:].lstrip()
+    parts = text.split(maxsplit=1)
+    if not parts:
+        return None
+    if parts[0] in NON_GAME_COMMANDS:
+        return "non_game"
+    return "game" if parts[0] in GAME_COMMANDS else None
+
+
+async def on_update_gate(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # group -1: 모든 명령(슬래시/한글)과 버튼에 토큰 버킷·과부하 차단을 핸들러보다 먼저 적용
+    chat, user = update.effective_chat, update.effective_user
+    if chat is None or user is None:
+        return
+    query = update.callback_query
+    if query is not None:
+        if not admit(chat.id, user.id):
+            await query.answer("잠시 후 다시 눌러주세요.")
+            raise ApplicationHandlerStop
+        return
+    kind = command_kind(update.effective_message.text if update.effective_message else None)
+    if kind is None:
+        return
+    if not admit(chat.id, user.id) or (load_monitor.overloaded and kind == "non_game"):
+        raise ApplicationHandlerStop
+
+
 async def on_korean_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not update.message or not update.message.text:
         return
@@ -380,9 +1367,15 @@ async def on_korean_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
     cmd = parts[0]
     args = parts[1:]
 
+    if cmd not in NON_GAME_COMMANDS and cmd not in GAME_COMMANDS:
+        return
+
     if cmd in ["내정보", "정보", "프로필"]:
         await cmd_info(update, context)
         return
+    if cmd in ["통계", "상세전적"]:
+        await cmd_stats(update, context)
+        return
     if cmd in ["랭킹", "순위", "랭크"]:
         await cmd_rank(update, context)
         return
@@ -402,6 +1395,28 @@ async def on_korean_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if cmd in ["강제초기화", "초기화", "리셋"]:
         await cmd_force_reset(update, context)
         return
+    if cmd in ["토너먼트", "토너"]:
+        context.args = []
+        if args and args[0].isdigit():
+            context.args = [args[0]]
+        await cmd_tournament(update, context)
+        return
+    if cmd in ["봇", "봇추가"]:
+        context.args = args
+        await cmd_add_bots(update, context)
+        return
+    if cmd in ["경제", "칩통계"]:
+        context.args = args
+        await cmd_economy(update, context)
+        return
+    if cmd in ["프로파일", "프로파일링"]:
+        context.args = args
+        await cmd_profile(update, context)
+        return
+    if cmd in ["일괄", "일괄작업"]:
+        context.args = args
+        await cmd_bulk(update, context)
+        return
     if cmd in ["관리자임명", "관리자", "어드민"]:
         context.args = args
         await cmd_set_admin(update, context)
@@ -415,8 +1430,71 @@ async def cmd_force_reset(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id = update.effective_chat.id
     if chat_id in rooms:
         del rooms[chat_id]
+    if chat_id in tournaments:
+        await cancel_tournament(tournaments[chat_id])
     await update.message.reply_text("방 상태 초기화 완료")
 
+# -경제 [분] : 출처별 칩 유입/유출 집계 + 이상 징후 (관리자)
+async def cmd_economy(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user = update.effective_user
+    if not await storage.is_admin(user.id):
+        await update.message.reply_text("권한이 없습니다. (관리자 전용)")
+        return
+    minutes = 60
+    if context.args and context.args[0].isdigit():
+        minutes = max(1, min(ECON_RETENTION_MIN, int(context.args[0])))
+    rows = economy.series(minutes)
+
+    totals: Dict[str, List[int]] = {}
+    for _, sources in rows:
+        for src, (inflow, outflow, n) in sources.items():
+            t = totals.setdefault(src, [0, 0, 0])
+            t[0] += inflow
+            t[1] += outflow
+            t[2] += n
+    lines = ["💰 칩 경제 (최근 {}분)".format(minutes)]
+    if not totals:
+        lines.append("(기록 없음)")
+    for src in sorted(totals):
+        inflow, outflow, n = totals[src]
+        lines.append("- {}: +{} / -{} ({}건)".format(src, inflow, outflow, n))
+
+    # 분당 순유입 추이: 최대 12구간으로 묶어서 표시
+    if rows:
+        now = int(time.time() // 60)
+        step = max(1, (minutes + 11) // 12)
+        slots: Dict[int, int] = {}
+        for m, sources in rows:
+            slot = (now - m) // step
+            slots[slot] = slots.get(slot, 0) + sum(v[0] - v[1] for v in sources.values())
+        series = " ".join(str(slots.get(i, 0)) for i in reversed(range((minutes + step - 1) // step)))
+        lines.append("순유입 추이({}분 단위, 과거→현재): {}".format(step, series))
+
+    if storage.is_db:
+        lines.append("DB 차단기 {} / 대기 쓰기 {}건".format(storage.breaker.state, storage.write_backlog()))
+
+    lines.append("⚠️ 이상 징후")
+    alerts = list(economy.alerts)[-10:]
+    lines.extend(alerts or ["(없음)"])
+    await update.message.reply_text("\n".join(lines))
+
+# -봇 [수] : 로비에 봇 좌석 추가 (관리자)
+async def cmd_add_bots(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user = update.effective_user
+    room = rooms.get(update.effective_chat.id)
+    if not room or room.state != "LOBBY":
+        await update.message.reply_text("대기 중인 로비가 없습니다. -바둑이 로 먼저 로비를 만드세요.")
+        return
+    # 봇 스택은 하우스 칩이라 호스트가 마음대로 채우면 칩 파밍이 됨 → 관리자 전용
+    if not await storage.is_admin(user.id):
+        await update.message.reply_text("권한이 없습니다. (관리자 전용)")
+        return
+    count = 1
+    if context.args and context.args[0].isdigit():
+        count = int(context.args[0])
+    added = fill_with_bots(room, min(MAX_PLAYERS, len(room.players) + count))
+    await update.message.reply_text("🤖 봇 {}명 추가 (참가 인원 {}/{})".format(added, len(room.players), MAX_PLAYERS))
+
 async def cmd_set_admin(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     if not await storage.is_primary_admin(user.id):
@@ -437,6 +1515,9 @@ async def cmd_set_admin(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def cmd_badugi(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id = update.effective_chat.id
     user = update.effective_user
+    if draining:
+        await update.message.reply_text("봇 재시작 준비 중입니다. 잠시 후 다시 시도해주세요.")
+        return
     await storage.ensure_user(user.id, user.username or user.full_name)
 
     if context.args and len(context.args) >= 1 and context.args[0].isdigit():
@@ -459,63 +1540,65 @@ async def cmd_badugi(update: Update, context: ContextTypes.DEFAULT_TYPE):
             room.min_chips = min_chips
             room.join_bonus = JOIN_BONUS
 
-    keyboard = [
-        [InlineKeyboardButton("참가", callback_data=CB_JOIN)],
-        [InlineKeyboardButton("시작", callback_data=CB_START)],
-    ]
-    current_players = ", ".join([p.username or str(pid) for pid, p in room.players.items()]) or "(없음)"
-    msg = (
-        "🎲 바둑이 로비 생성!\n"
-        "스테이크: ante {}, 최소 보유칩 {}, 참가 보너스 +{}\n"
-        "참가 인원: {}/{}\n"
-        "현재 참가자: {}\n"
-        "호스트: {}"
-    ).format(room.ante, room.min_chips, room.join_bonus, len(room.players), MAX_PLAYERS, current_players, room.host_id)
-    await update.message.reply_text(msg, reply_markup=InlineKeyboardMarkup(keyboard))
+    room.lobby_message = await update.message.reply_text(lobby_text(room, "🎲 바둑이 로비 생성!"), reply_markup=lobby_keyboard())
 
 # =====================
 # 버튼 핸들러
 # =====================
 async def on_button(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
-    await query.answer()
     data = query.data
     chat_id = query.message.chat_id
     user = query.from_user
 
+    if data == CB_JOIN and chat_id in rooms:
+        # 참가는 묶음 처리 후 개별 query.answer 로 응답
+        await enqueue_join(context, rooms[chat_id], query)
+        return
+    await query.answer()
+
+    if data in (CB_TOUR_JOIN, CB_TOUR_START, CB_TOUR_CANCEL):
+        await on_tournament_button(update, context)
+        return
+
     room = rooms.get(chat_id)
+    if data not in (CB_JOIN, CB_START):
+        # DM/토너먼트 테이블에서 누른 액션 버튼은 진행 중인 판으로 라우팅
+        room = player_rooms.get(user.id) or room
     if not room:
         await query.edit_message_text("방이 존재하지 않습니다. -바둑이 로 다시 시작")
         return
 
-    if data == CB_JOIN:
-        if room.state != "LOBBY":
-            return
-        if len(room.players) >= MAX_PLAYERS:
-            return
-        if user.id not in room.players:
-            prof = await storage.get_profile(user.id)
-            if prof["chips"] < room.min_chips:
-                await query.edit_message_text("최소 {}칩 이상 보유해야 참가 가능합니다. -출석 으로 칩을 모아보세요.".format(room.min_chips))
-                return
-            await storage.add_chips(user.id, room.join_bonus)
-            room.players[user.id] = Player(user_id=user.id, username=user.username or user.full_name)
-        await refresh_lobby(query.message, room)
-        return
-
     if data == CB_START:
         if user.id != room.host_id and not await storage.is_primary_admin(user.id):
             await query.edit_message_text("호스트 또는 최초 관리자만 시작할 수 있습니다.")
             return
+        if room.state != "LOBBY":
+            return
+        if draining:
+            await query.edit_message_text("봇 재시작 준비 중입니다. 재시작 후 로비가 복구됩니다.")
+            return
+        if BOT_FILL:
+            fill_with_bots(room, MIN_PLAYERS)
         if len(room.players) < MIN_PLAYERS:
             await query.edit_message_text("최소 2명 이상 필요합니다.")
             return
+        room.state = "DEAL"
         await query.edit_message_text("게임을 시작합니다! DM을 확인하세요.")
-        await start_round(context, room)
+        spawn_hand(context, start_round(context, room))
         return
 
-    # 배팅/교환 액션 (턴 기반)
     pid = user.id
+    if data.startswith("exch_") and pid in room.exchange_pending:
+        # 동시 교환: 차례와 무관하게 선택만 기록
+        try:
+            cnt = int(data.split("_")[1])
+        except Exception:
+            cnt = 0
+        record_exchange_choice(room, pid, cnt)
+        return
+
+    # 배팅/교환 액션 (턴 기반)
     if room.awaiting_user != pid and data != CB_RAISE_CUSTOM:
         return
 
@@ -544,24 +1627,87 @@ async def on_button(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await handle_exchange_choice(context, room, pid, max(0, min(4, cnt)))
         return
 
-async def refresh_lobby(message, room: GameRoom):
-    keyboard = [
+def lobby_keyboard() -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup([
         [InlineKeyboardButton("참가", callback_data=CB_JOIN)],
         [InlineKeyboardButton("시작", callback_data=CB_START)],
-    ]
+    ])
+
+
+def lobby_text(room: GameRoom, title: str) -> str:
     current_players = ", ".join([p.username or str(pid) for pid, p in room.players.items()]) or "(없음)"
+    return (
+        "{}\n"
+        "스테이크: ante {}, 최소 보유칩 {}, 참가 보너스 +{}\n"
+        "참가 인원: {}/{}\n"
+        "현재 참가자: {}\n"
+        "호스트: {}"
+    ).format(title, room.ante, room.min_chips, room.join_bonus, len(room.players), MAX_PLAYERS, current_players, room.host_id)
+
+
+async def refresh_lobby(message, room: GameRoom):
     try:
-        msg = (
-            "🎲 바둑이 로비\n"
-            "스테이크: ante {}, 최소 보유칩 {}, 참가 보너스 +{}\n"
-            "참가 인원: {}/{}\n"
-            "현재 참가자: {}\n"
-            "호스트: {}"
-        ).format(room.ante, room.min_chips, room.join_bonus, len(room.players), MAX_PLAYERS, current_players, room.host_id)
-        await message.edit_text(msg, reply_markup=InlineKeyboardMarkup(keyboard))
-    except BadRequest:
+        await message.edit_text(lobby_text(room, "🎲 바둑이 로비"), reply_markup=lobby_keyboard())
+    except (BadRequest, RetryAfter):
         pass
 
+
+async def enqueue_join(context: ContextTypes.DEFAULT_TYPE, room: GameRoom, query):
+    if draining:
+        await query.answer("봇 재시작 준비 중입니다. 재시작 후 다시 참가해주세요.")
+        return
+    if room.state != "LOBBY":
+        await query.answer("현재 라운드 진행 중입니다.")
+        return
+    room.join_queue.append(query)
+    room.lobby_message = query.message
+    if room.join_task is None:
+        room.join_task = context.application.create_task(process_join_batch(room))
+
+
+async def process_join_batch(room: GameRoom):
+    # JOIN_BATCH_MS 동안 모인 참가 요청을 한 번에 처리: $in 조회 1회, 보너스 지급 1회, 로비 갱신 1회
+    await asyncio.sleep(JOIN_BATCH_MS / 1000.0)
+    batch, room.join_queue = room.join_queue, []
+    room.join_task = None
+
+    replies: List[Tuple[Any, str]] = []
+    pending: Dict[int, Any] = {}
+    for q in batch:
+        uid = q.from_user.id
+        if uid in room.players or uid in pending:
+            replies.append((q, "이미 참가했습니다."))
+        else:
+            pending[uid] = q
+    profiles = await storage.get_profiles(list(pending)) if pending else {}
+
+    accepted: List[int] = []
+    deferred = storage.writes_deferred()
+    for uid, q in pending.items():
+        if room.state != "LOBBY":
+            replies.append((q, "현재 라운드 진행 중입니다."))
+        elif uid in room.players:
+            # 조회를 기다리는 동안 다른 묶음이 먼저 앉혔을 수 있음 → 보너스 중복 지급 방지
+            replies.append((q, "이미 참가했습니다."))
+        elif deferred:
+            replies.append((q, DB_BUSY_TEXT))
+        elif draining:
+            replies.append((q, "봇 재시작 준비 중입니다. 재시작 후 다시 참가해주세요."))
+        elif profiles[uid]["chips"] < room.min_chips:
+            replies.append((q, "최소 {}칩 이상 보유해야 참가 가능합니다. -출석 으로 칩을 모아보세요.".format(room.min_chips)))
+        elif len(room.players) >= MAX_PLAYERS and not remove_bot(room):
+            replies.append((q, "참가 인원이 가득 찼습니다."))
+        else:
+            room.players[uid] = Player(user_id=uid, username=q.from_user.username or q.from_user.full_name)
+            accepted.append(uid)
+            replies.append((q, "참가 완료! +{}칩".format(room.join_bonus)))
+
+    if accepted:
+        if room.join_bonus:
+            await storage.add_chips_many(accepted, room.join_bonus, source="join_bonus")
+        await refresh_lobby(room.lobby_message, room)
+    await asyncio.gather(*(q.answer(text) for q, text in replies), return_exceptions=True)
+
 # =====================
 # 라운드 진행
 # =====================
@@ -571,51 +1717,83 @@ async def start_round(context: ContextTypes.DEFAULT_TYPE, room: GameRoom):
     room.pot_antes = 0
     room.make_deck()
 
+    for p in room.players.values():
+        p.ante_paid = 0
+        p.total_put = 0
+
+    # 앤티를 걷기 전에 인원부터 확정 → 취소되는 판에서 칩이 빠져나가지 않음
     to_kick: List[int] = []
     for pid in list(room.players.keys()):
         p = room.players[pid]
-        prof = await storage.get_profile(pid)
-        if prof["chips"] < room.ante:
+        chips = await room_chips(room, pid)
+        if p.is_bot and chips < room.ante:
+            storage.reset_bot(pid, BOT_STACK)
+            economy.record("bot_refill", pid, BOT_STACK - chips)
+            chips = BOT_STACK
+        elif chips < room.ante and room.tournament is None:
             to_kick.append(pid)
-            continue
-        await storage.add_chips(pid, -room.ante)
-        room.pot_antes += room.ante
-        p.folded = False
-        p.current_bet = 0
-        p.total_put = 0
-        p.all_in = False
-        p.hand = room.deal(4)
-        try:
-            await context.bot.send_message(pid, "당신의 패: {}".format(format_hand(p.hand)))
-        except Forbidden:
-            await context.bot.send_message(room.chat_id, "DM 불가 → 공개: {}의 패 {}".format(p.username, format_hand(p.hand)))
+        p.stack = chips
 
     for pid in to_kick:
         await context.bot.send_message(room.chat_id, "{} 님은 앤티 부족으로 제외".format(room.players[pid].username))
         del room.players[pid]
 
-    if len(room.players) < MIN_PLAYERS:
+    if len(room.players) < round_min_players(room):
         await context.bot.send_message(room.chat_id, "인원 부족으로 라운드를 취소합니다.")
         room.state = "LOBBY"
+        for p in room.players.values():
+            p.stack = None
         return
 
+    for pid, p in list(room.players.items()):
+        ante = min(room.ante, p.stack)  # 토너먼트: 앤티가 모자라면 남은 칩 전부로 올인
+        # 기록을 먼저 남김 → 쓰기 도중 취소돼도 환불 금액에 포함
+        p.ante_paid = ante
+        room.pot_antes += ante
+        await room_add_chips(room, pid, -ante, source="ante")
+        p.folded = False
+        p.current_bet = 0
+        p.total_put = 0
+        p.all_in = ante < room.ante
+        p.vpip = False
+        p.fold_street = ""
+        p.hand = room.deal(4)
+        if p.is_bot:
+            continue
+        try:
+            await context.bot.send_message(pid, "당신의 패: {}".format(format_hand(p.hand)))
+        except Forbidden:
+            await context.bot.send_message(room.chat_id, "DM 불가 → 공개: {}의 패 {}".format(p.username, format_hand(p.hand)))
+
     room.turn_order = list(room.players.keys())
     random.shuffle(room.turn_order)
+    seat_players(room)
+    tag = room.tag()
 
-    await betting_round(context, room, phase="BET1", title="1차 배팅")
-    if alive_count(room) < MIN_PLAYERS:
-        await showdown(context, room)
-        return
+    try:
+        await betting_round(context, room, phase="BET1", title=tag + "1차 배팅")
+        if alive_count(room) < round_min_players(room):
+            await showdown(context, room)
+            return
 
-    await exchange_round(context, room, phase="EXC1", title="1차 교환")
-    await betting_round(context, room, phase="BET2", title="2차 배팅")
-    if alive_count(room) < MIN_PLAYERS:
+        await exchange_round(context, room, phase="EXC1", title=tag + "1차 교환")
+        await betting_round(context, room, phase="BET2", title=tag + "2차 배팅")
+        if alive_count(room) < round_min_players(room):
+            await showdown(context, room)
+            return
+
+        await exchange_round(context, room, phase="EXC2", title=tag + "2차 교환")
+        await betting_round(context, room, phase="BET3", title=tag + "3차 배팅(최종)")
         await showdown(context, room)
-        return
+    finally:
+        unseat_players(room)
+        for p in room.players.values():
+            p.stack = None
 
-    await exchange_round(context, room, phase="EXC2", title="2차 교환")
-    await betting_round(context, room, phase="BET3", title="3차 배팅(최종)")
-    await showdown(context, room)
+
+def round_min_players(room: GameRoom) -> int:
+    # 토너먼트 테이블은 헤즈업까지 진행 — MIN_PLAYERS 는 일반 방 개시 인원
+    return 2 if room.tournament is not None else MIN_PLAYERS
 
 
 def alive_count(room: GameRoom) -> int:
@@ -636,72 +1814,79 @@ async def betting_round(context: ContextTypes.DEFAULT_TYPE, room: GameRoom, phas
     if len(active) < 2:
         return
 
-    progressed_any = True
-    while progressed_any:
-        progressed_any = False
-        for pid in list(active):
-            player = room.players.get(pid)
-            if not player or player.folded or player.all_in:
-                continue
-            need = max(0, room.current_bet - player.current_bet)
-            prof = await storage.get_profile(pid)
-            mychips = prof["chips"]
-
-            buttons = [[InlineKeyboardButton("콜", callback_data=CB_CALL), InlineKeyboardButton("폴드", callback_data=CB_FOLD)]]
-            raise_row: List[InlineKeyboardButton] = []  # type: ignore
-            if mychips > need:
-                for amt in RAISE_CHOICES:
-                    if mychips >= need + amt:
-                        raise_row.append(InlineKeyboardButton("+{}".format(amt), callback_data="{}{}".format(CB_RAISE, amt)))
-                raise_row.append(InlineKeyboardButton("올인", callback_data="{}allin".format(CB_RAISE)))
-                raise_row.append(InlineKeyboardButton("직접입력", callback_data=CB_RAISE_CUSTOM))
-            if raise_row:
-                buttons.append(raise_row)
-
-            room.awaiting_user = pid
-            try:
-                await context.bot.send_message(
-                    pid,
-                    (
-                        "{}\n"
-                        "현재 콜: {} / 당신 필요: {}\n"
-                        "보유칩: {}"
-                    ).format(title, room.current_bet, need, mychips),
-                    reply_markup=InlineKeyboardMarkup(buttons),
-                )
-            except Forbidden:
-                await context.bot.send_message(
-                    room.chat_id,
-                    "{} 님 DM 불가 → 여기서 선택".format(player.username),
-                    reply_markup=InlineKeyboardMarkup(buttons),
-                )
+    # 액션 대기열: 처음엔 전원, 레이즈가 나오면 레이저 다음 순서부터 나머지 전원으로 재구성.
+    # 대기열이 비는 순간(= 마지막 공격자까지 한 바퀴) 라운드 종료 → 이미 맞춘 사람에게 다시 묻지 않음
+    room.last_aggressor = None
+    queue: Deque[int] = deque(pid for pid in active if can_act(room.players[pid]))
+    while queue and alive_count(room) > 1:
+        pid = queue.popleft()
+        player = room.players.get(pid)
+        if not player or not can_act(player):
+            continue
+        need = max(0, room.current_bet - player.current_bet)
+        if need == 0 and not any(q != pid and can_act(room.players[q]) for q in active):
+            # 상대가 모두 올인/폴드 → 더 배팅할 상대가 없음
+            continue
+        mychips = await room_chips(room, pid)
+        bet_before = room.current_bet
+        if player.is_bot:
+            # 봇은 DM/대기 없이 즉시 결정
+            await bot_act(context, room, player, need, mychips)
+        else:
+            await prompt_bet(context, room, player, title, need, mychips)
+        if room.current_bet > bet_before:
+            room.last_aggressor = pid
+            i = active.index(pid)
+            queue = deque(q for q in active[i + 1:] + active[:i] if can_act(room.players[q]))
+    room.awaiting_user = None
 
-            try:
-                await asyncio.wait_for(wait_until_turn_done(room, pid), timeout=BETTING_SECONDS)
-            except asyncio.TimeoutError:
-                if mychips >= need:
-                    await handle_call(context, room, pid, silent=True)
-                else:
-                    await handle_fold(context, room, pid, silent=True)
 
-            progressed_any = True
+def can_act(p: Player) -> bool:
+    return not p.folded and not p.all_in
 
-        if bets_settled(room) or alive_count(room) <= 1:
-            room.awaiting_user = None
-            return
 
+def bet_buttons(need: int, mychips: int) -> InlineKeyboardMarkup:
+    buttons = [[InlineKeyboardButton("콜", callback_data=CB_CALL), InlineKeyboardButton("폴드", callback_data=CB_FOLD)]]
+    raise_row: List[InlineKeyboardButton] = []  # type: ignore
+    if mychips > need:
+        for amt in RAISE_CHOICES:
+            if mychips >= need + amt:
+                raise_row.append(InlineKeyboardButton("+{}".format(amt), callback_data="{}{}".format(CB_RAISE, amt)))
+        raise_row.append(InlineKeyboardButton("올인", callback_data="{}allin".format(CB_RAISE)))
+        raise_row.append(InlineKeyboardButton("직접입력", callback_data=CB_RAISE_CUSTOM))
+    if raise_row:
+        buttons.append(raise_row)
+    return InlineKeyboardMarkup(buttons)
 
-def bets_settled(room: GameRoom) -> bool:
-    # 올인이 아닌 생존자들의 current_bet이 모두 동일하면 정산 완료
-    target = None
-    for p in room.players.values():
-        if p.folded or p.all_in:
-            continue
-        if target is None:
-            target = p.current_bet
-        elif p.current_bet != target:
-            return False
-    return True
+
+async def prompt_bet(context: ContextTypes.DEFAULT_TYPE, room: GameRoom, player: Player, title: str, need: int, mychips: int):
+    pid = player.user_id
+    markup = bet_buttons(need, mychips)
+    room.awaiting_user = pid
+    try:
+        await context.bot.send_message(
+            pid,
+            (
+                "{}\n"
+                "현재 콜: {} / 당신 필요: {}\n"
+                "보유칩: {}"
+            ).format(title, room.current_bet, need, mychips),
+            reply_markup=markup,
+        )
+    except Forbidden:
+        await context.bot.send_message(
+            room.chat_id,
+            "{} 님 DM 불가 → 여기서 선택".format(player.username),
+            reply_markup=markup,
+        )
+
+    try:
+        await asyncio.wait_for(wait_until_turn_done(room, pid), timeout=BETTING_SECONDS)
+    except asyncio.TimeoutError:
+        if mychips >= need:
+            await handle_call(context, room, pid, silent=True)
+        else:
+            await handle_fold(context, room, pid, silent=True)
 
 async def wait_until_turn_done(room: GameRoom, pid: int):
     while room.awaiting_user == pid or room.awaiting_custom_raise == pid:
@@ -726,13 +1911,14 @@ async def on_private_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not text.isdigit():
         return
     user_id = update.effective_user.id
-    for chat_id, room in rooms.items():
-        if room.awaiting_custom_raise == user_id and (chat_id, user_id) in pending_custom_raise:
-            amount = int(text)
-            pending_custom_raise.discard((chat_id, user_id))
-            room.awaiting_custom_raise = None
-            await handle_raise(context, room, user_id, amount)
-            return
+    if not user_limiter.allow(user_id):
+        return
+    room = player_rooms.get(user_id)
+    if room and room.awaiting_custom_raise == user_id and (room.chat_id, user_id) in pending_custom_raise:
+        amount = int(text)
+        pending_custom_raise.discard((room.chat_id, user_id))
+        room.awaiting_custom_raise = None
+        await handle_raise(context, room, user_id, amount)
 
 # =====================
 # 교환 라운드 (DM 우선)
@@ -742,33 +1928,76 @@ async def exchange_round(context: ContextTypes.DEFAULT_TYPE, room: GameRoom, pha
     await context.bot.send_message(room.chat_id, "🔁 {} 시작! 각자 DM에서 0~4장 교환을 선택하세요.".format(title))
 
     active = [pid for pid in room.turn_order if not room.players[pid].folded]
+    if EXCHANGE_CONCURRENT:
+        await exchange_round_concurrent(context, room, active, title)
+        return
     for pid in active:
         p = room.players[pid]
         room.awaiting_user = pid
-        keyboard = [[InlineKeyboardButton("{}장".format(i), callback_data=CB_EXC[i]) for i in range(0, 5)]]
-        try:
-            await context.bot.send_message(
-                pid,
-                ("{}\n현재 패: {}\n교환할 장수를 선택하세요").format(title, format_hand(p.hand)),
-                reply_markup=InlineKeyboardMarkup(keyboard),
-            )
-        except Forbidden:
-            await context.bot.send_message(
-                room.chat_id,
-                "{} DM 불가 → 여기서 교환 수 선택".format(p.username),
-                reply_markup=InlineKeyboardMarkup(keyboard),
-            )
+        if p.is_bot:
+            await handle_exchange_choice(context, room, pid, bot_exchange_count(p.hand))
+            continue
+        await send_exchange_prompt(context, room, p, title)
         try:
             await asyncio.wait_for(wait_until_turn_done(room, pid), timeout=EXCHANGE_SECONDS)
         except asyncio.TimeoutError:
             await handle_exchange_choice(context, room, pid, 0, silent=True)
     room.awaiting_user = None
 
-async def handle_exchange_choice(context: ContextTypes.DEFAULT_TYPE, room: GameRoom, pid: int, count: int, silent: bool = False):
-    p = room.players.get(pid)
-    if not p or p.folded:
-        room.awaiting_user = None
-        return
+async def exchange_round_concurrent(context: ContextTypes.DEFAULT_TYPE, room: GameRoom, active: List[int], title: str):
+    # 전원에게 동시에 묻고, 모두 응답하거나 공통 마감이 지나면 turn_order 순서대로 딜
+    room.exchange_choices = {}
+    room.exchange_pending = set()
+    room.exchange_done = asyncio.Event()
+    prompts = []
+    for pid in active:
+        p = room.players[pid]
+        if p.is_bot:
+            room.exchange_choices[pid] = bot_exchange_count(p.hand)
+        else:
+            room.exchange_pending.add(pid)
+            prompts.append(send_exchange_prompt(context, room, p, title))
+    await asyncio.gather(*prompts)
+    if room.exchange_pending:
+        try:
+            await asyncio.wait_for(room.exchange_done.wait(), timeout=EXCHANGE_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+    room.exchange_pending.clear()
+    room.exchange_done = None
+
+    summary: List[str] = []
+    for pid in active:
+        p = room.players.get(pid)
+        if not p or p.folded:
+            continue
+        count = room.exchange_choices.get(pid, 0)
+        apply_exchange(room, p, count)
+        summary.append("{} {}장".format(p.username, count))
+    await context.bot.send_message(room.chat_id, "{} 완료: {}".format(title, ", ".join(summary) or "(없음)"))
+
+def record_exchange_choice(room: GameRoom, pid: int, count: int):
+    room.exchange_choices[pid] = max(0, min(4, count))
+    room.exchange_pending.discard(pid)
+    if not room.exchange_pending and room.exchange_done is not None:
+        room.exchange_done.set()
+
+async def send_exchange_prompt(context: ContextTypes.DEFAULT_TYPE, room: GameRoom, p: Player, title: str):
+    keyboard = [[InlineKeyboardButton("{}장".format(i), callback_data=CB_EXC[i]) for i in range(0, 5)]]
+    try:
+        await context.bot.send_message(
+            p.user_id,
+            ("{}\n현재 패: {}\n교환할 장수를 선택하세요").format(title, format_hand(p.hand)),
+            reply_markup=InlineKeyboardMarkup(keyboard),
+        )
+    except Forbidden:
+        await context.bot.send_message(
+            room.chat_id,
+            "{} DM 불가 → 여기서 교환 수 선택".format(p.username),
+            reply_markup=InlineKeyboardMarkup(keyboard),
+        )
+
+def apply_exchange(room: GameRoom, p: Player, count: int):
     count = max(0, min(4, count))
     if count > 0:
         idxs = heuristic_discards(p.hand, count)
@@ -777,6 +2006,14 @@ async def handle_exchange_choice(context: ContextTypes.DEFAULT_TYPE, room: GameR
             if 0 <= i < len(p.hand):
                 p.hand.pop(i)
         p.hand.extend(room.deal(count))
+
+async def handle_exchange_choice(context: ContextTypes.DEFAULT_TYPE, room: GameRoom, pid: int, count: int, silent: bool = False):
+    p = room.players.get(pid)
+    if not p or p.folded:
+        room.awaiting_user = None
+        return
+    count = max(0, min(4, count))
+    apply_exchange(room, p, count)
     if not silent:
         await context.bot.send_message(room.chat_id, "{} 교환 {}장 완료".format(p.username, count))
     room.awaiting_user = None
@@ -789,12 +2026,13 @@ async def handle_call(context: ContextTypes.DEFAULT_TYPE, room: GameRoom, pid: i
     if not p or p.folded:
         return
     need = max(0, room.current_bet - p.current_bet)
-    prof = await storage.get_profile(pid)
-    mychips = prof["chips"]
+    mychips = max(0, await room_chips(room, pid, fresh=True))
     to_put = min(need, mychips)
-    await storage.add_chips(pid, -to_put)
     p.current_bet += to_put
     p.total_put += to_put
+    await room_add_chips(room, pid, -to_put, source="bet")
+    if to_put > 0:
+        p.vpip = True
     if to_put < need:
         p.all_in = True
     if not silent:
@@ -806,6 +2044,7 @@ async def handle_fold(context: ContextTypes.DEFAULT_TYPE, room: GameRoom, pid: i
     if not p:
         return
     p.folded = True
+    p.fold_street = room.state
     if not silent:
         await context.bot.send_message(room.chat_id, "{} 폴드".format(p.username))
     room.awaiting_user = None
@@ -815,8 +2054,7 @@ async def handle_raise(context: ContextTypes.DEFAULT_TYPE, room: GameRoom, pid:
     if not p or p.folded:
         return
     need = max(0, room.current_bet - p.current_bet)
-    prof = await storage.get_profile(pid)
-    mychips = prof["chips"]
+    mychips = max(0, await room_chips(room, pid, fresh=True))
 
     if amount == 0:  # all-in 버튼
         to_put = mychips
@@ -829,9 +2067,10 @@ async def handle_raise(context: ContextTypes.DEFAULT_TYPE, room: GameRoom, pid:
             await context.bot.send_message(room.chat_id, "잔액이 부족합니다. 더 작은 금액을 입력하세요.")
             return
 
-    await storage.add_chips(pid, -to_put)
     p.current_bet += to_put
     p.total_put += to_put
+    await room_add_chips(room, pid, -to_put, source="bet")
+    p.vpip = True
     room.current_bet = max(room.current_bet, p.current_bet)
     if to_put == mychips:
         p.all_in = True
@@ -851,10 +2090,12 @@ async def showdown(context: ContextTypes.DEFAULT_TYPE, room: GameRoom):
 
     pots = build_side_pots(room)
 
-    lines = ["👑 쇼다운"]
+    lines = ["{}👑 쇼다운".format(room.tag())]
     for p in alive:
         lines.append("- {}: {} → 키 {}".format(p.username, format_hand(p.hand), badugi_rank_key(p.hand)))
 
+    # 지급 목록을 await 없이 먼저 확정 → 지급 중 종료돼도 드레인이 room.unpaid 로 이어서 지급
+    won: Dict[int, int] = {pid: 0 for pid in room.players}
     for i, pot in enumerate(pots, 1):
         elig = [room.players[pid] for pid in pot["eligible"] if not room.players[pid].folded]
         if not elig:
@@ -864,16 +2105,41 @@ async def showdown(context: ContextTypes.DEFAULT_TYPE, room: GameRoom):
         winners = [pl for pl in ranked if badugi_rank_key(pl.hand) == best]
         share = pot["amount"] // max(1, len(winners))
         for w in winners:
-            await storage.add_chips(w.user_id, share)
-            await storage.record_game(w.user_id, True)
-        for l in [pl for pl in elig if pl.user_id not in [w.user_id for w in winners]]:
-            await storage.record_game(l.user_id, False)
+            room.unpaid.append((w.user_id, share))
+            won[w.user_id] += share
         lines.append("팟{}: {}칩 → 승자 {} (각 {})".format(i, pot['amount'], ", ".join(w.username for w in winners), share))
+    await pay_unpaid(room)
 
     await context.bot.send_message(room.chat_id, "\n".join(lines))
     room.state = "LOBBY"
+    if room.tournament is not None:
+        return
+    await record_hand_results(room, won)
     await context.bot.send_message(room.chat_id, "새 라운드를 시작하려면 -바둑이 를 입력하세요.")
 
+async def pay_unpaid(room: GameRoom):
+    while room.unpaid:
+        pid, amount = room.unpaid.pop(0)
+        await room_add_chips(room, pid, amount, source="pot")
+
+# 판 결과 기록: 참가자별 전적 + 통계 집계를 1회 쓰기로 반영
+async def record_hand_results(room: GameRoom, won: Dict[int, int]):
+    for pid, p in room.players.items():
+        gain = won.get(pid, 0)
+        stats = {
+            "hands": 1,
+            "net": gain - p.total_put - room.ante,
+            "vpip": 1 if p.vpip else 0,
+            "best_pot": gain,
+        }
+        if p.folded:
+            stats["fold_{}".format(p.fold_street or "BET1")] = 1
+        else:
+            stats["showdowns"] = 1
+            if -badugi_rank_key(p.hand)[0] == 4:
+                stats["badugis"] = 1
+        await storage.record_game(pid, gain > 0, stats)
+
 # 사이드팟 생성: total_put 기반 티어링 + 앤티를 가장 작은 팟에 합산
 def build_side_pots(room: GameRoom) -> List[Dict[str, Any]]:
     contrib = {pid: p.total_put for pid, p in room.players.items() if not p.folded}
@@ -898,6 +2164,224 @@ def build_side_pots(room: GameRoom) -> List[Dict[str, Any]]:
         pots.append({"amount": room.pot_antes, "eligible": elig_all})
     return pots
 
+# =====================
+# 토너먼트 (등록 → 다중 테이블 → 밸런싱/파이널 테이블 → 상금 정산)
+# =====================
+def tournament_keyboard() -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton("등록", callback_data=CB_TOUR_JOIN)],
+        [InlineKeyboardButton("시작", callback_data=CB_TOUR_START), InlineKeyboardButton("취소", callback_data=CB_TOUR_CANCEL)],
+    ])
+
+
+def tournament_lobby_text(tour: Tournament) -> str:
+    names = ", ".join(tour.entrants.values()) or "(없음)"
+    return (
+        "🏆 바둑이 토너먼트 등록\n"
+        "바이인 {}칩 / 시작 스택 {} / 앤티 {}부터 {}초마다 x{}\n"
+        "등록 인원: {}명\n"
+        "참가자: {}\n"
+        "{}분 안에 시작하지 않으면 자동 취소되고 바이인이 환불됩니다."
+    ).format(tour.buy_in, TOUR_STACK, TOUR_ANTE_START, TOUR_LEVEL_SECONDS, TOUR_ANTE_GROWTH, len(tour.entrants), names,
+             max(1, TOUR_REG_SECONDS // 60))
+
+
+# -토너먼트 [바이인]
+async def cmd_tournament(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    chat_id = update.effective_chat.id
+    user = update.effective_user
+    if draining:
+        await update.message.reply_text("봇 재시작 준비 중입니다. 잠시 후 다시 시도해주세요.")
+        return
+    await storage.ensure_user(user.id, user.username or user.full_name)
+    tour = tournaments.get(chat_id)
+    if tour and tour.state != "REG":
+        await update.message.reply_text("토너먼트가 진행 중입니다.")
+        return
+    if not tour:
+        buy_in = TOUR_BUYIN_DEFAULT
+        if context.args and context.args[0].isdigit():
+            buy_in = int(context.args[0])
+        tour = Tournament(chat_id=chat_id, host_id=user.id, buy_in=buy_in)
+        tournaments[chat_id] = tour
+        scheduler.schedule(TOUR_REG_SECONDS, lambda: tournament_reg_expired(context, tour))
+    await update.message.reply_text(tournament_lobby_text(tour), reply_markup=tournament_keyboard())
+
+
+async def on_tournament_button(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    chat_id = query.message.chat_id
+    user = query.from_user
+    tour = tournaments.get(chat_id)
+    if not tour or tour.state != "REG":
+        return
+
+    if query.data == CB_TOUR_JOIN:
+        if user.id in tour.entrants:
+            return
+        if storage.writes_deferred():
+            await context.bot.send_message(chat_id, DB_BUSY_TEXT)
+            return
+        prof = await storage.get_profile(user.id)
+        if prof["chips"] < tour.buy_in:
+            await context.bot.send_message(chat_id, "{} 님 바이인 {}칩이 부족합니다.".format(user.username or user.full_name, tour.buy_in))
+            return
+        await storage.add_chips(user.id, -tour.buy_in, source="tour_buyin")
+        tour.entrants[user.id] = user.username or user.full_name
+        try:
+            await query.message.edit_text(tournament_lobby_text(tour), reply_markup=tournament_keyboard())
+        except BadRequest:
+            pass
+        return
+
+    if user.id != tour.host_id and not await storage.is_primary_admin(user.id):
+        return
+    if query.data == CB_TOUR_CANCEL:
+        await cancel_tournament(tour)
+        try:
+            await query.message.edit_text("🏆 토너먼트가 취소되었습니다. 바이인 {}명 환불 완료".format(len(tour.entrants)))
+        except BadRequest:
+            pass
+        return
+    if draining:
+        return
+    if len(tour.entrants) < 2:
+        await context.bot.send_message(chat_id, "토너먼트는 최소 2명 이상 필요합니다.")
+        return
+    await start_tournament(context, tour)
+
+
+async def start_tournament(context: ContextTypes.DEFAULT_TYPE, tour: Tournament):
+    tour.state = "RUNNING"
+    ids = list(tour.entrants)
+    random.shuffle(ids)
+    n_tables = max(1, math.ceil(len(ids) / TOUR_TABLE_SIZE))
+    for no in range(1, n_tables + 1):
+        tour.tables[no] = GameRoom(
+            chat_id=tour.chat_id, host_id=tour.host_id, ante=tour.ante,
+            min_chips=0, join_bonus=0, tournament=tour, table_no=no,
+        )
+    for i, uid in enumerate(ids):
+        tour.stacks[uid] = TOUR_STACK
+        table = tour.tables[i % n_tables + 1]
+        table.players[uid] = Player(user_id=uid, username=tour.entrants[uid])
+
+    lines = ["🏆 토너먼트 시작! {}명 / {}테이블".format(len(ids), n_tables)]
+    for no, table in tour.tables.items():
+        lines.append("T{}: {}".format(no, ", ".join(p.username for p in table.players.values())))
+    await context.bot.send_message(tour.chat_id, "\n".join(lines))
+
+    scheduler.schedule(TOUR_LEVEL_SECONDS, lambda: tournament_level_up(context, tour))
+    for table in list(tour.tables.values()):
+        spawn_hand(context, tournament_table_loop(context, tour, table))
+
+
+async def tournament_reg_expired(context: ContextTypes.DEFAULT_TYPE, tour: Tournament):
+    # 등록만 열어 둔 채 방치된 토너먼트: 바이인이 묶이지 않도록 자동 취소
+    if tour.state != "REG" or tournaments.get(tour.chat_id) is not tour:
+        return
+    await cancel_tournament(tour)
+    await context.bot.send_message(tour.chat_id, "⌛ 토너먼트 등록 마감 → 자동 취소, 바이인 {}명 환불".format(len(tour.entrants)))
+
+
+async def tournament_level_up(context: ContextTypes.DEFAULT_TYPE, tour: Tournament):
+    if tour.state != "RUNNING":
+        return
+    tour.level += 1
+    tour.ante = max(tour.ante + 1, math.ceil(tour.ante * TOUR_ANTE_GROWTH))
+    await context.bot.send_message(tour.chat_id, "⏫ 레벨 {} - 앤티 {} (다음 판부터)".format(tour.level, tour.ante))
+    scheduler.schedule(TOUR_LEVEL_SECONDS, lambda: tournament_level_up(context, tour))
+
+
+async def tournament_table_loop(context: ContextTypes.DEFAULT_TYPE, tour: Tournament, table: GameRoom):
+    while tour.state == "RUNNING" and not draining and tour.tables.get(table.table_no) is table:
+        for p in table.incoming:
+            table.players[p.user_id] = p
+        table.incoming.clear()
+        if len(table.players) < round_min_players(table):
+            # 이동 인원을 기다리거나, 테이블 수를 줄일 수 있으면 해체
+            notes = balance_tables(tour, table)
+            if notes:
+                await context.bot.send_message(tour.chat_id, "\n".join(notes))
+            await asyncio.sleep(1)
+            continue
+        table.ante = tour.ante
+        await start_round(context, table)
+        await after_tournament_hand(context, tour, table)
+
+
+async def after_tournament_hand(context: ContextTypes.DEFAULT_TYPE, tour: Tournament, table: GameRoom):
+    notes: List[str] = []
+    for pid in [pid for pid in table.players if tour.stacks.get(pid, 0) <= 0]:
+        del table.players[pid]
+        tour.busted.append(pid)
+        notes.append("💀 {} 탈락 ({}위)".format(tour.entrants.get(pid, pid), len(tour.entrants) - len(tour.busted) + 1))
+
+    if tour.remaining() <= 1:
+        if notes:
+            await context.bot.send_message(tour.chat_id, "\n".join(notes))
+        await finish_tournament(context, tour)
+        return
+    notes.extend(balance_tables(tour, table))
+    if notes:
+        await context.bot.send_message(tour.chat_id, "\n".join(notes))
+
+
+def balance_tables(tour: Tournament, table: GameRoom) -> List[str]:
+    # 판이 끝난(대기 중인) 테이블만 조정 — 다른 테이블로는 incoming 으로 보내 다음 판부터 착석
+    others = [t for t in tour.tables.values() if t is not table]
+    if not others:
+        return []
+    notes: List[str] = []
+    needed = max(1, math.ceil(tour.remaining() / TOUR_TABLE_SIZE))
+    if len(tour.tables) > needed:
+        movers = list(table.players.values()) + table.incoming
+        table.players.clear()
+        table.incoming.clear()
+        del tour.tables[table.table_no]
+        for p in movers:
+            target = min(others, key=tour.seated)
+            target.incoming.append(p)
+            notes.append("🔀 {} → T{}".format(p.username, target.table_no))
+        notes.insert(0, "T{} 해체".format(table.table_no))
+        if len(tour.tables) == 1:
+            notes.append("🏁 파이널 테이블 (T{})".format(others[0].table_no))
+        return notes
+    while table.players and tour.seated(table) - min(tour.seated(t) for t in others) >= 2:
+        target = min(others, key=tour.seated)
+        pid = random.choice(list(table.players))
+        target.incoming.append(table.players.pop(pid))
+        notes.append("🔀 {} T{} → T{} (밸런싱)".format(tour.entrants.get(pid, pid), table.table_no, target.table_no))
+    return notes
+
+
+async def finish_tournament(context: ContextTypes.DEFAULT_TYPE, tour: Tournament):
+    if tour.state != "RUNNING":
+        return
+    tour.state = "DONE"
+    tournaments.pop(tour.chat_id, None)
+    survivors = [pid for t in tour.tables.values() for pid in list(t.players) + [p.user_id for p in t.incoming]]
+    order = survivors + list(reversed(tour.busted))  # 1위부터
+    pool = tour.buy_in * len(tour.entrants)
+    prizes = [pool * pct // 100 for pct in TOUR_PAYOUTS][:len(order)]
+    if prizes:
+        prizes[0] += pool - sum(prizes)
+
+    lines = ["🏆 토너먼트 종료! 상금 풀 {}칩".format(pool)]
+    for place, (pid, prize) in enumerate(zip(order, prizes), 1):
+        # 토너먼트 결과는 여기서 한 번만 영구 잔액에 반영
+        await storage.add_chips(pid, prize, source="tour_payout")
+        lines.append("{}위 {} +{}칩".format(place, tour.entrants.get(pid, pid), prize))
+    await context.bot.send_message(tour.chat_id, "\n".join(lines))
+
+
+async def cancel_tournament(tour: Tournament):
+    # 종료 전 취소: 바이인 환불 (토너먼트 스택은 폐기)
+    tour.state = "DONE"
+    tournaments.pop(tour.chat_id, None)
+    for uid in tour.entrants:
+        await storage.add_chips(uid, tour.buy_in, source="tour_refund")
+
 # =====================
 # 랜덤 칩 지급 (그룹/채널)
 # =====================
@@ -906,12 +2390,12 @@ async def on_any_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     if not user or user.is_bot:
         return
-    if chat.type == "private":
+    if chat.type == "private" or load_monitor.overloaded:
         return
     if random.random() < GIVEAWAY_PROB and await storage.can_giveaway(chat.id, user.id):
         amount = random.randint(GIVEAWAY_MIN, GIVEAWAY_MAX)
         await storage.ensure_user(user.id, user.username or user.full_name)
-        await storage.add_chips(user.id, amount)
+        await storage.add_chips(user.id, amount, source="giveaway")
         await storage.mark_giveaway(chat.id, user.id)
         name = user.username or user.full_name
         await context.bot.send_message(chat.id, "🎉 @{} 님 보너스 +{}칩!".format(name, amount))
@@ -919,6 +2403,513 @@ async def on_any_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
 # =====================
 # 에러 핸들러 & 앱 초기화
 # =====================
+async def stats_compaction_loop():
+    # 일별 통계 버킷을 주기적으로 월별로 압축해 유저 문서 크기를 제한
+    while True:
+        await asyncio.sleep(STATS_COMPACT_INTERVAL_SEC)
+        try:
+            n = await storage.compact_daily_stats(STATS_DAILY_KEEP_DAYS)
+            if n:
+                logger.info("통계 압축 완료: %d명", n)
+        except Exception as e:
+            logger.warning("통계 압축 실패: %s", e)
+
+
+async def economy_flush_loop():
+    # 지난 분 버킷을 모아 DB에 적재 (메시지 처리 경로와 분리)
+    while True:
+        await asyncio.sleep(ECON_FLUSH_SEC)
+        try:
+            await storage.save_economy_buckets(economy.take_finished())
+        except Exception as e:
+            logger.warning("칩 경제 적재 실패: %s", e)
+
+
+# =====================
+# 런타임 프로파일러 (관리자 요청 시에만 훅 설치 → 비활성 시 오버헤드 없음)
+# =====================
+class RuntimeProfiler:
+    def __init__(self):
+        self.active = False
+        self.samples: Dict[str, int] = {}  # 접힌 스택("a;b;c") → 샘플 수
+        self.idle = 0  # 이벤트 루프가 selector 에서 I/O 를 기다리던 샘플 수 (CPU 순위에서 제외)
+        self.awaits: Dict[str, List[float]] = {}  # 호출 키 → [횟수, 누적ms, 최대ms]
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._bot_cls: Any = None
+        self._bot_post: Any = None
+
+    def start(self, bot: Any):
+        self.active = True
+        self.samples = {}
+        self.idle = 0
+        self.awaits = {}
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._sample_loop, args=(threading.get_ident(),), daemon=True)
+        self._thread.start()
+        self._install(bot)
+
+    def stop(self):
+        self._uninstall()
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=1)
+        self.active = False
+
+    def _sample_loop(self, tid: int):
+        # 이벤트 루프 스레드의 현재 스택을 주기적으로 채집
+        interval = PROFILE_SAMPLE_MS / 1000.0
+        while not self._stop.wait(interval):
+            frame = sys._current_frames().get(tid)
+            if frame is not None and os.path.basename(frame.f_code.co_filename) == "selectors.py":
+                self.idle += 1
+                continue
+            stack: List[str] = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append("{} ({}:{})".format(code.co_name, os.path.basename(code.co_filename), code.co_firstlineno))
+                frame = frame.f_back
+            if stack:
+                key = ";".join(reversed(stack))
+                self.samples[key] = self.samples.get(key, 0) + 1
+
+    def _record(self, key: str, ms: float):
+        row = self.awaits.setdefault(key, [0, 0.0, 0.0])
+        row[0] += 1
+        row[1] += ms
+        row[2] = max(row[2], ms)
+
+    def _install(self, bot: Any):
+        # Storage 공개 코루틴 메서드는 인스턴스 속성으로, 텔레그램 API 는 봇 클래스의 _do_post 로 감쌈
+        for name in dir(Storage):
+            fn = getattr(storage, name)
+            if name.startswith("_") or name == "drain_writes" or not asyncio.iscoroutinefunction(fn):
+                continue
+            setattr(storage, name, self._wrap("storage." + name, fn))
+        self._bot_cls = type(bot)
+        self._bot_post = self._bot_cls.__dict__.get("_do_post")
+        original = self._bot_cls._do_post
+        profiler = self
+
+        async def timed_post(bot_self, endpoint, *args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await original(bot_self, endpoint, *args, **kwargs)
+            finally:
+                profiler._record("telegram." + endpoint, (time.perf_counter() - started) * 1000)
+
+        self._bot_cls._do_post = timed_post
+
+    def _uninstall(self):
+        for name in list(vars(storage)):
+            if name in Storage.__dict__:
+                delattr(storage, name)
+        if self._bot_cls is not None:
+            if self._bot_post is not None:
+                self._bot_cls._do_post = self._bot_post
+            else:
+                del self._bot_cls._do_post
+            self._bot_cls = None
+            self._bot_post = None
+
+    def _wrap(self, key: str, fn: Callable[..., Awaitable[Any]]):
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await fn(*args, **kwargs)
+            finally:
+                self._record(key, (time.perf_counter() - started) * 1000)
+        return wrapper
+
+    def report(self, seconds: int) -> str:
+        total = sum(self.samples.values())
+        leaf: Dict[str, int] = {}
+        for key, n in self.samples.items():
+            name = key.rsplit(";", 1)[-1]
+            leaf[name] = leaf.get(name, 0) + n
+        lines = [
+            "🔬 프로파일 결과 ({}초, 샘플 {}개)".format(seconds, total + self.idle),
+            "루프 유휴(I/O 대기) {:.1f}%".format(100.0 * self.idle / max(1, total + self.idle)),
+            "[CPU 상위 (self, 유휴 제외 비율)]",
+        ]
+        for name, n in sorted(leaf.items(), key=lambda x: -x[1])[:PROFILE_TOP_N]:
+            lines.append("{:5.1f}% {}".format(100.0 * n / max(1, total), name))
+        if not leaf:
+            lines.append("(바쁜 샘플 없음)")
+        lines.append("[await 누적 시간 상위]")
+        rows = sorted(self.awaits.items(), key=lambda x: -x[1][1])[:PROFILE_TOP_N]
+        for key, (count, total_ms, max_ms) in rows:
+            lines.append("{} n={} 평균 {:.1f}ms 최대 {:.0f}ms 합계 {:.0f}ms".format(key, int(count), total_ms / count, max_ms, total_ms))
+        if not rows:
+            lines.append("(호출 없음)")
+        return "\n".join(lines)
+
+    def folded(self) -> bytes:
+        # flamegraph.pl / speedscope 호환 접힌 스택 형식
+        return "".join("{} {}\n".format(k, n) for k, n in self.samples.items()).encode("utf-8")
+
+profiler = RuntimeProfiler()
+
+
+# -프로파일 [초] : N초간 샘플링 후 관리자 DM으로 리포트 + 플레임그래프 파일 전송
+async def cmd_profile(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user = update.effective_user
+    if not await storage.is_admin(user.id):
+        await update.message.reply_text("권한이 없습니다. (관리자 전용)")
+        return
+    if profiler.active:
+        await update.message.reply_text("이미 프로파일링 중입니다.")
+        return
+    seconds = 30
+    if context.args and context.args[0].isdigit():
+        seconds = max(1, min(PROFILE_MAX_SECONDS, int(context.args[0])))
+    profiler.start(context.bot)
+    await update.message.reply_text("🔬 {}초 동안 프로파일링합니다. 결과는 DM으로 보냅니다.".format(seconds))
+    context.application.create_task(finish_profile(context, user.id, update.effective_chat.id, seconds))
+
+
+async def finish_profile(context: ContextTypes.DEFAULT_TYPE, admin_id: int, chat_id: int, seconds: int):
+    try:
+        await asyncio.sleep(seconds)
+    finally:
+        profiler.stop()
+    text = profiler.report(seconds)
+    filename = "profile-{}.folded".format(datetime.now(KST).strftime("%Y%m%d-%H%M%S"))
+    try:
+        await context.bot.send_message(admin_id, text)
+        await context.bot.send_document(admin_id, document=io.BytesIO(profiler.folded()), filename=filename)
+    except Forbidden:
+        await context.bot.send_message(chat_id, "DM 불가 → 요약만 공개\n{}".format(text))
+
+# =====================
+# 관리자 일괄 칩 작업
+# =====================
+# 작업 문서(bulk_jobs): 종류(grant/reset/csv), 커서(마지막 _id 또는 CSV 행 위치), 진행 집계, 상태.
+# 배치마다 커서를 저장하므로 재시작 후 on_post_init 에서 running 작업을 이어서 실행
+bulk_tasks: Dict[str, asyncio.Task] = {}
+
+
+def bulk_job_text(job: Dict[str, Any]) -> str:
+    label = {"grant": "활성 유저 {}칩 지급".format(job.get("amount")), "reset": "전체 {}칩 초기화".format(STARTING_CHIPS), "csv": "CSV 조정"}[job["kind"]]
+    total = job.get("total") or 0
+    pct = " ({:.0f}%)".format(min(100.0, job["scanned"] * 100 / total)) if total else ""
+    status = {"running": "진행 중", "done": "완료", "cancelled": "중지됨"}.get(job["status"], job["status"])
+    return "📦 일괄 작업 {} [{}] {}\n처리 {}/{}{} · 반영 {} · 건너뜀 {}".format(
+        job["_id"], status, label, job["scanned"], total, pct, job["applied"], job["skipped"]
+    )
+
+
+async def bulk_next_batch(job: Dict[str, Any]) -> Tuple[List[Tuple[int, int, Optional[int]]], Any, int]:
+    # (ops, 다음 커서, 읽은 수) — 읽은 수가 0 이면 끝
+    if job["kind"] == "csv":
+        start = job["cursor"] or 0
+        rows = job["rows"][start:start + BULK_BATCH]
+        return [(uid, delta, None) for uid, delta in rows], start + len(rows), len(rows)
+    docs = await storage.scan_users(job["cursor"], BULK_BATCH, job.get("since"))
+    if not docs:
+        return [], job["cursor"], 0
+    if job["kind"] == "grant":
+        ops = [(d["_id"], job["amount"], None) for d in docs]
+    else:
+        ops = [(d["_id"], STARTING_CHIPS - d.get("chips", STARTING_CHIPS), d.get("chips", STARTING_CHIPS))
+               for d in docs if d.get("chips", STARTING_CHIPS) != STARTING_CHIPS]
+    return ops, docs[-1]["_id"], len(docs)
+
+
+async def bulk_report(bot, job: Dict[str, Any]):
+    text = bulk_job_text(job)
+    try:
+        if job.get("message_id"):
+            await bot.edit_message_text(chat_id=job["chat_id"], message_id=job["message_id"], text=text)
+            return
+    except BadRequest as e:
+        if "not modified" in str(e).lower():
+            return
+    except Exception as e:
+        logger.warning("일괄 작업 진행 표시 실패: %s", e)
+        return
+    try:
+        msg = await bot.send_message(job["chat_id"], text)
+        job["message_id"] = msg.message_id
+    except Exception as e:
+        logger.warning("일괄 작업 진행 표시 실패: %s", e)
+
+
+async def run_bulk_job(app: Application, job: Dict[str, Any]):
+    last_report = 0.0
+    try:
+        while job["status"] == "running":
+            # 라이브 방 우선: DB 차단기 open·밀린 쓰기·루프 과부하 동안은 배치를 멈춤
+            while not storage.breaker.allow() or storage.write_backlog() or load_monitor.overloaded:
+                if draining:
+                    return
+                await asyncio.sleep(1)
+            if draining:
+                # 상태는 running 그대로 → 다음 프로세스가 커서부터 이어서 실행
+                return
+            ops, cursor, read = await bulk_next_batch(job)
+            if read == 0:
+                job["status"] = "done"
+                break
+            applied = set(await storage.bulk_add_chips(job["_id"], ops))
+            for uid, delta, _ in ops:
+                if uid in applied:
+                    economy.record("bulk", uid, delta)
+            job["cursor"] = cursor
+            job["scanned"] += read
+            job["applied"] += len(applied)
+            job["skipped"] += len(ops) - len(applied)
+            job["updated"] = datetime.now(timezone.utc)
+            await storage.save_bulk_job(job)
+            if time.monotonic() - last_report >= 3:
+                last_report = time.monotonic()
+                await bulk_report(app.bot, job)
+            await asyncio.sleep(BULK_PAUSE_MS / 1000)
+        job["updated"] = datetime.now(timezone.utc)
+        await storage.save_bulk_job(job)
+        logger.info("일괄 작업 %s 종료: %s", job["_id"], bulk_job_text(job).replace("\n", " "))
+        await bulk_report(app.bot, job)
+    except Exception:
+        logger.exception("일괄 작업 %s 실패 (커서 %s 에서 재시작 시 재개)", job["_id"], job.get("cursor"))
+    finally:
+        bulk_tasks.pop(job["_id"], None)
+
+
+def start_bulk_job(app: Application, job: Dict[str, Any]):
+    bulk_tasks[job["_id"]] = app.create_task(run_bulk_job(app, job))
+
+
+async def resume_bulk_jobs(app: Application):
+    for job in await storage.load_bulk_jobs("running"):
+        logger.info("일괄 작업 %s 재개 (커서 %s)", job["_id"], job.get("cursor"))
+        job["message_id"] = None
+        start_bulk_job(app, job)
+
+
+def parse_adjustments(text: str) -> Tuple[List[List[int]], int]:
+    # "유저ID,증감" 행 → 같은 유저는 합산; 숫자가 아닌 행(헤더 등)은 건너뛴 수로 반환
+    totals: Dict[int, int] = {}
+    bad = 0
+    for row in csv.reader(io.StringIO(text)):
+        cells = [c.strip() for c in row if c.strip()]
+        if not cells:
+            continue
+        try:
+            uid, delta = int(cells[0]), int(cells[1])
+        except (ValueError, IndexError):
+            bad += 1
+            continue
+        totals[uid] = totals.get(uid, 0) + delta
+    return [[uid, delta] for uid, delta in sorted(totals.items()) if delta], bad
+
+
+# -일괄 지급 <칩(음수=회수)> [일수] | -일괄 초기화 확인 | -일괄 조정 (+CSV 줄 또는 CSV 파일에 답장) | -일괄 상태 | -일괄 중지
+async def cmd_bulk(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user = update.effective_user
+    if not await storage.is_primary_admin(user.id):
+        await update.message.reply_text("최초 관리자만 사용할 수 있습니다.")
+        return
+    args = context.args or []
+    sub = args[0] if args else "상태"
+
+    if sub in ["상태", "status"]:
+        jobs = await storage.load_bulk_jobs("running")
+        await update.message.reply_text("\n".join(bulk_job_text(j) for j in jobs) or "진행 중인 일괄 작업이 없습니다.")
+        return
+    if sub in ["중지", "stop"]:
+        jobs = await storage.load_bulk_jobs("running")
+        for job in jobs:
+            task = bulk_tasks.pop(job["_id"], None)
+            if task:
+                task.cancel()
+            job["status"] = "cancelled"
+            await storage.save_bulk_job(job)
+        await update.message.reply_text("일괄 작업 {}건 중지".format(len(jobs)) if jobs else "진행 중인 일괄 작업이 없습니다.")
+        return
+    if bulk_tasks:
+        await update.message.reply_text("이미 진행 중인 일괄 작업이 있습니다. (-일괄 상태 / -일괄 중지)")
+        return
+
+    job: Dict[str, Any] = {
+        # _id 는 유저 문서의 last_bulk 표식으로도 쓰이므로 작업마다 달라야 함
+        "_id": "bulk-{}".format(datetime.now(KST).strftime("%Y%m%d-%H%M%S-%f")),
+        "created": datetime.now(timezone.utc),
+        "by": user.id,
+        "chat_id": update.effective_chat.id,
+        "message_id": None,
+        "status": "running",
+        "cursor": None,
+        "scanned": 0,
+        "applied": 0,
+        "skipped": 0,
+    }
+    if sub in ["지급", "grant"]:
+        if len(args) < 2 or not args[1].lstrip("-").isdigit() or int(args[1]) == 0:
+            await update.message.reply_text("사용법: -일괄 지급 <칩> [최근 활동 일수, 기본 {}]".format(BULK_ACTIVE_DAYS))
+            return
+        # 음수(회수)는 잔액이 충분한 유저에게만 반영 — 잔액이 음수가 되지 않음
+        days = int(args[2]) if len(args) > 2 and args[2].isdigit() else BULK_ACTIVE_DAYS
+        job.update(kind="grant", amount=int(args[1]), since=datetime.now(timezone.utc) - timedelta(days=days))
+        job["total"] = await storage.count_users(job["since"])
+    elif sub in ["초기화", "reset"]:
+        if len(args) < 2 or args[1] not in ["확인", "confirm"]:
+            await update.message.reply_text("모든 유저 칩을 {}으로 되돌립니다. 실행하려면: -일괄 초기화 확인".format(STARTING_CHIPS))
+            return
+        job.update(kind="reset")
+        job["total"] = await storage.count_users()
+    elif sub in ["조정", "csv"]:
+        # CSV: 명령 다음 줄부터 입력하거나, 업로드한 CSV 파일 메시지에 답장
+        text = update.message.text.partition("\n")[2]
+        reply = update.message.reply_to_message
+        if not text.strip() and reply and reply.document:
+            tg_file = await context.bot.get_file(reply.document.file_id)
+            text = bytes(await tg_file.download_as_bytearray()).decode("utf-8-sig", errors="replace")
+        rows, bad = parse_adjustments(text)
+        if not rows:
+            await update.message.reply_text("사용법: -일괄 조정 다음 줄부터 '유저ID,증감' 입력 (또는 CSV 파일에 답장)")
+            return
+        if len(rows) > BULK_CSV_MAX:
+            await update.message.reply_text("CSV 행이 너무 많습니다. (최대 {})".format(BULK_CSV_MAX))
+            return
+        job.update(kind="csv", rows=rows, total=len(rows))
+        if bad:
+            await update.message.reply_text("숫자가 아닌 {}행은 건너뜁니다.".format(bad))
+    else:
+        await update.message.reply_text("사용법: -일괄 지급|초기화|조정|상태|중지")
+        return
+
+    await storage.save_bulk_job(job)
+    await bulk_report(context.bot, job)
+    start_bulk_job(context.application, job)
+
+# =====================
+# 종료 드레인 & 재시작 인계
+# =====================
+def room_snapshot(room: GameRoom) -> Dict[str, Any]:
+    return {
+        "_id": room.chat_id,
+        "host_id": room.host_id,
+        "ante": room.ante,
+        "min_chips": room.min_chips,
+        "join_bonus": room.join_bonus,
+        "players": [{"user_id": p.user_id, "username": p.username} for p in room.players.values() if not p.is_bot],
+    }
+
+
+async def refund_unfinished_hand(room: GameRoom):
+    # 마감까지 끝나지 않은 판: 낸 앤티+배팅을 돌려주고 로비로 되돌림
+    for p in room.players.values():
+        paid = p.ante_paid + p.total_put
+        if paid > 0:
+            await room_add_chips(room, p.user_id, paid, source="refund")
+        p.ante_paid = 0
+        p.total_put = 0
+    unseat_players(room)
+    room.state = "LOBBY"
+
+
+def request_shutdown(app: Application):
+    global draining, drain_task
+    if draining:
+        # Application.stop() 은 create_task 로 만든 태스크(드레인·판 진행)를 모두 기다리므로
+        # 먼저 취소해야 바로 종료됨. 이후 신호는 기본 동작(프로세스 종료)으로 되돌림
+        logger.warning("종료 신호 재수신 → 드레인 중단, 즉시 종료")
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.remove_signal_handler(sig)
+        if drain_task is not None:
+            drain_task.cancel()
+        for task in list(hand_tasks) + list(bulk_tasks.values()):
+            task.cancel()
+        app.stop_running()
+        return
+    draining = True
+    drain_task = app.create_task(drain_and_stop(app))
+
+
+async def drain_and_stop(app: Application):
+    # 새 로비/판 차단 → 진행 중인 판은 DRAIN_SECONDS 까지 마무리 → 나머지는 환불 후 로비로 저장 → 종료
+    pending = [t for t in hand_tasks if not t.done()]
+    logger.info("종료 드레인 시작: 진행 중인 판 %d개 (최대 %d초 대기)", len(pending), DRAIN_SECONDS)
+    for room in list(rooms.values()):
+        if room.state != "LOBBY":
+            try:
+                await app.bot.send_message(room.chat_id, "⚠️ 봇 재시작 예정: 진행 중인 판까지만 진행합니다.")
+            except Exception:
+                pass
+    if pending:
+        _, pending_set = await asyncio.wait(pending, timeout=DRAIN_SECONDS)
+        for task in pending_set:
+            task.cancel()
+        # 취소가 끝날 때까지 기다려야 환불이 반쯤 진행된 칩 변경과 섞이지 않음
+        await asyncio.gather(*pending_set, return_exceptions=True)
+
+    for room in list(rooms.values()):
+        if room.state == "SHOWDOWN":
+            # 승자는 이미 정해짐 → 남은 팟만 지급
+            await pay_unpaid(room)
+            unseat_players(room)
+            room.state = "LOBBY"
+        elif room.state != "LOBBY":
+            await refund_unfinished_hand(room)
+    for tour in list(tournaments.values()):
+        await cancel_tournament(tour)
+
+    saved = 0
+    try:
+        saved = await storage.save_rooms([room_snapshot(r) for r in rooms.values() if r.players])
+    except Exception as e:
+        logger.warning("방 상태 저장 실패: %s", e)
+    left = await storage.flush_writes(timeout=10)
+    if left:
+        logger.error("종료 시 반영 못한 DB 쓰기 %d건", left)
+    logger.info("종료 드레인 완료: 방 %d개 저장", saved)
+    app.stop_running()
+
+
+async def restore_rooms(app: Application):
+    # 이전 프로세스가 저장한 방을 로비 상태로 복구
+    for doc in await storage.load_rooms():
+        chat_id = doc["_id"]
+        room = GameRoom(
+            chat_id=chat_id, host_id=doc["host_id"], ante=doc["ante"],
+            min_chips=doc["min_chips"], join_bonus=doc["join_bonus"],
+        )
+        for row in doc.get("players", []):
+            room.players[row["user_id"]] = Player(user_id=row["user_id"], username=row["username"])
+        rooms[chat_id] = room
+        try:
+            room.lobby_message = await app.bot.send_message(
+                chat_id, lobby_text(room, "♻️ 봇 재시작 - 로비 복구"), reply_markup=lobby_keyboard()
+            )
+        except Exception as e:
+            logger.warning("로비 복구 알림 실패 %s: %s", chat_id, e)
+    if rooms:
+        logger.info("방 %d개 복구", len(rooms))
+
+
+async def on_post_init(app: Application) -> None:
+    with startup_phase("storage"):
+        await storage.bootstrap()
+    with startup_phase("tables"):
+        strength_table()
+    with startup_phase("restore_rooms"):
+        await restore_rooms(app)
+    await resume_bulk_jobs(app)
+    try:
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(sig, request_shutdown, app)
+    except (NotImplementedError, RuntimeError):
+        logger.warning("시그널 핸들러 등록 불가 → 드레인 없이 종료됨")
+    app.create_task(storage.drain_writes())
+    app.create_task(stats_compaction_loop())
+    app.create_task(economy_flush_loop())
+    app.create_task(scheduler.run())
+    app.create_task(load_monitor.run())
+    log_startup_report()
+
+
 async def on_error(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
     logger.error("Exception while handling an update:", exc_info=context.error)
 
@@ -926,38 +2917,57 @@ async def on_error(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
 def build_app() -> Application:
     if not BOT_TOKEN:
         raise RuntimeError("환경변수 BOT_TOKEN 이 설정되어야 합니다.")
-    app = ApplicationBuilder().token(BOT_TOKEN).build()
+    load_telegram()
+    from telegram.ext import ApplicationBuilder, CallbackQueryHandler, CommandHandler, MessageHandler, TypeHandler, filters
+    from telegram import Update
+
+    app = ApplicationBuilder().token(BOT_TOKEN).post_init(on_post_init).build()
+
+    # 레이트 리밋/과부하 게이트: 다른 모든 핸들러보다 먼저 (group -1)
+    app.add_handler(TypeHandler(Update, on_update_gate), group=-1)
 
     # 영문 슬래시 명령(호환용)
     app.add_handler(CommandHandler("start", cmd_start))
     app.add_handler(CommandHandler("myinfo", cmd_info))
+    app.add_handler(CommandHandler("stats", cmd_stats))
     app.add_handler(CommandHandler("rank", cmd_rank))
     app.add_handler(CommandHandler("transfer", cmd_transfer))
     app.add_handler(CommandHandler("checkin", cmd_checkin))
     app.add_handler(CommandHandler("forcereset", cmd_force_reset))
     app.add_handler(CommandHandler("setadmin", cmd_set_admin))
+    app.add_handler(CommandHandler("economy", cmd_economy))
+    app.add_handler(CommandHandler("profile", cmd_profile))
+    app.add_handler(CommandHandler("bulk", cmd_bulk))
     app.add_handler(CommandHandler("badugi", cmd_badugi))
+    app.add_handler(CommandHandler("tournament", cmd_tournament))
+
+    # DM에서 사용자 입력 레이즈 처리 — 같은 그룹에서는 먼저 매칭된 핸들러만 실행되므로
+    # 숫자만 보낸 DM 을 한글 텍스트 트리거보다 앞에서 가로챔
+    app.add_handler(MessageHandler(filters.ChatType.PRIVATE & filters.Regex(r"^\s*\d+\s*$"), on_private_text))
 
     # 한글 텍스트 트리거(슬래시 없이 사용, "-명령어" 지원)
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, on_korean_text))
 
     app.add_handler(CallbackQueryHandler(on_button))
 
-    # DM에서 사용자 입력 레이즈 처리
-    app.add_handler(MessageHandler(filters.ChatType.PRIVATE & filters.TEXT, on_private_text))
-
-    # 랜덤 칩 지급 등 일반 메시지 처리 (마지막에)
-    app.add_handler(MessageHandler(~filters.COMMAND & filters.ALL, on_any_message))
+    # 랜덤 칩 지급 등 일반 메시지 처리 — 별도 그룹이라 위 핸들러가 처리한 메시지에도 실행됨
+    app.add_handler(MessageHandler(~filters.COMMAND & filters.ALL, on_any_message), group=1)
 
     app.add_error_handler(on_error)
     return app
 
 
 def main():
-    app = build_app()
+    with startup_phase("telegram_import"):
+        load_telegram()
+    with startup_phase("build_app"):
+        app = build_app()
     logger.info("🤖 바둑이 게임봇 v6.1 시작")
-    app.run_polling(drop_pending_updates=True)
+    # 종료 시그널은 직접 처리(드레인); 재시작 시 밀린 버튼 입력은 새 프로세스가 이어서 처리
+    app.run_polling(drop_pending_updates=DROP_PENDING_UPDATES, stop_signals=None)
+
 
+startup_phases["module"] = (time.perf_counter() - _MODULE_STARTED) * 1000
 
 if __name__ == "__main__":
     main()